@@ -5,52 +5,124 @@ class Backtrack():
     
     This should be roughly the same implementation as that of Verlaan
     """
-    def __init__(self, s0, h=None, _tree = True):
+    def __init__(self, s0, h=None, _tree = True, limit = None):
         self.s0 = s0
         self.h = h
         self.root = Node(self.s0, None, None)
         self.visited = 0
         self.tree = {self.root.s}
         self._tree = _tree
+        # optional cap on visited nodes, after which the search gives up
+        self.limit = limit
+        # the goal node, once found
+        self.goal = None
+        # the search driven by self.step, and whether it has ended
+        self.search = None
+        self.done = False
     
     def run(self):
+        """Starts the search from the initial state
+
+        Returns:
+            The list of nodes from the root to the goal node, or None if no solution was found
+        """
         if not self.run_rec(self.root):
-            print("no solution found")
+            if not self.exceeded():
+                print("no solution found")
             return None
-        return
+        return self.goal.getRoute()
+
+    def exceeded(self):
+        """Whether the search was cut off by self.limit
+        """
+        return self.limit is not None and self.visited > self.limit
+
+    def step(self, k):
+        """Advances the search by at most k visited nodes, so it can be interleaved with other searches
+
+        Args:
+            k: the number of nodes to visit
+
+        Returns:
+            The list of nodes from the root to the goal node once found, otherwise None. self.done tells whether the search has ended
+        """
+        if self.search is None:
+            self.search = self.walk(self.root)
+        try:
+            for _ in range(k):
+                next(self.search)
+        except StopIteration as stop:
+            self.done = True
+            return self.goal.getRoute() if stop.value else None
+        return None
 
     def run_rec(self, node: Node):
+        """Searches depth-first from a node
+
+        Returns:
+            Whether a goal node was found, which is then stored in self.goal
+        """
+        search = self.walk(node)
+        try:
+            while True:
+                next(search)
+        except StopIteration as stop:
+            return stop.value
+
+    def walk(self, node: Node):
+        """Searches depth-first from a node, pausing after every visited node
+
+        Yields:
+            None after every visited node
+
+        Returns:
+            Whether a goal node was found, which is then stored in self.goal
+        """
         self.visited += 1
-        # Base case: If the current node is the goal, return True
-        if node.getValue() == 1:
-            return True
-        
-        if node.isTerminal():
+        if self.exceeded():
+            return False
+        yield
+        s = node.s
+        actions = s.getLiveActions()
+
+        # Base case: a terminal node, which is either the goal or a dead end
+        if len(actions) == 0:
+            if all(p.type == 6 for p in s.ps):
+                self.goal = node
+                return True
             return False
-        
-        node.getNexts()
-
-        if self._tree:
-            node.nexts = [n for n in node.nexts if n.s not in self.tree]
-            
-            for n in node.nexts:
-                self.tree.add(n.s)
-        
-        if self.h is not None:
-            # order the .nexts list by heuristic value
-            node.nexts = {next: node.s.heuristic(self.h, next.prevAction[0], next.prevAction[1]) for next in node.nexts}
-            node.nexts = [node[0] for node in sorted(node.nexts.items(), key=lambda x:x[1], reverse=True)]
 
-        # print(f"children of {node}: {node.nexts}")
-    
         # Iterate over the children nodes
-        for child in node.nexts:
+        for child in self.children(node, actions):
             # Recursive call to explore the child node
-            found_solution = self.run_rec(child)
+            found_solution = yield from self.walk(child)
             if found_solution:
                 return True
-        
-        # print(f"no solution found in {node}")
-        node.clearNexts()
 
-        return False
\ No newline at end of file
+        return False
+
+    def children(self, node: Node, actions):
+        """Lazily generates the children of a node in the order they should be explored
+
+        With heuristics, the actions are ordered by their heuristic value, which only needs the current state.
+        A child's state is only created when the search descends into it, and children whose state was seen before are skipped
+        if the transposition set is used.
+
+        Args:
+            node: the node to generate children of
+            actions: the actions possible in node's state
+
+        Yields:
+            Child nodes
+        """
+        s = node.s
+        if self.h is not None:
+            actions = sorted(actions, key=lambda a: s.heuristic(self.h, a[0], a[1]), reverse=True)
+
+        for (p1, p2) in actions:
+            child = Node(s.nextState(p1, p2), node, (p1, p2))
+            if self._tree:
+                if child.s in self.tree:
+                    continue
+                self.tree.add(child.s)
+            yield child
@@ -0,0 +1,159 @@
+from utils import Utils
+from corpus import Corpus
+import numpy as np
+
+class Batch():
+    """Legal captures of many positions at once, computed with NumPy
+
+    A batch of N positions is given as three arrays:
+        occ: (N,) uint64, the occupied squares as bitmasks (bit 8*y + x)
+        types: (N, 64) uint8, the type of the piece on every square, 0 for empty squares
+        caps: (N, 64) uint8, the captures left of the piece on every square
+    Only positions on the 8x8 board can be represented.
+
+    The kernel finds the squares every piece attacks with the ray tables of Utils: a ray is cut off behind its first
+    occupied square, which for the directions increasing the square index is the lowest set bit of the blockers and
+    for the others the highest. The results equal State.valCap, and so Utils.canReach, for every pair of pieces.
+    """
+
+    # RAYS[d, i]: Utils.rays[d][i]
+    RAYS = np.array(Utils.rays, dtype=np.uint64)
+    # STEPS[t, i]: Utils.steps[t][i] for knights, pawns and kings, 0 for the other types
+    STEPS = np.array([Utils.steps[t] if t in Utils.steps else [0] * 64 for t in range(7)], dtype=np.uint64)
+    # the directions of rooks and of bishops, see Utils.slides
+    ORTHOGONAL = Utils.slides[2]
+    DIAGONAL = Utils.slides[3]
+
+    @classmethod
+    def fromStates(cls, states):
+        """Stacks states into the arrays of a batch
+
+        Args:
+            states: a sequence of states with all pieces on the board
+
+        Returns:
+            An (occ, types, caps) tuple
+        """
+        n = len(states)
+        occ = np.zeros(n, dtype=np.uint64)
+        types = np.zeros((n, 64), dtype=np.uint8)
+        caps = np.zeros((n, 64), dtype=np.uint8)
+        for k, s in enumerate(states):
+            m = 0
+            for p, q in s.square.items():
+                if not (0 <= q.x <= 7 and 0 <= q.y <= 7):
+                    raise ValueError(f"square {q} is not on the board")
+                i = Utils.toIndex(q)
+                m |= 1 << i
+                types[k, i] = p.type
+                caps[k, i] = s.caps[p]
+            occ[k] = m
+        return occ, types, caps
+
+    @classmethod
+    def fromCorpus(cls, corpus):
+        """Decodes all records of a corpus into the arrays of a batch, without creating State objects
+
+        Args:
+            corpus: an open Corpus
+
+        Returns:
+            An (occ, types, caps) tuple
+        """
+        records = np.frombuffer(corpus.buf, dtype=np.uint8, count=corpus.count * Corpus.recordSize,
+                                offset=Corpus.header.size).reshape(corpus.count, Corpus.recordSize)
+        occ = records[:, :8].copy().view("<u8").reshape(-1).astype(np.uint64)
+
+        # piece bytes are stored in increasing square order, so square i holds the byte numbered by the occupied squares below it
+        bits = np.unpackbits(records[:, :8], axis=1, bitorder="little").astype(bool)
+        order = np.clip(np.cumsum(bits, axis=1) - 1, 0, Corpus.maxPieces - 1)
+        pieces = np.take_along_axis(records[:, 8:], order, axis=1) * bits
+        return occ, pieces >> 4, pieces & 15
+
+    @classmethod
+    def attacks(cls, occ, types):
+        """Computes the squares every piece attacks
+
+        Args:
+            occ: (N,) uint64 occupancy masks
+            types: (N, 64) piece types
+
+        Returns:
+            (N, 64) uint64, for every square the squares the piece on it could capture on if they were occupied
+        """
+        squares = np.arange(64)
+        blockers = occ[:, None]
+        one = np.uint64(1)
+
+        orthogonal = np.zeros(types.shape, dtype=np.uint64)
+        diagonal = np.zeros(types.shape, dtype=np.uint64)
+        for d in range(8):
+            ray = np.broadcast_to(cls.RAYS[d][squares], types.shape)
+            hit = ray & blockers
+            if d < 4:
+                # the nearest blocker is the lowest set bit, keep the ray up to it
+                first = hit & (~hit + one)
+                seen = ray & ((first << one) - one)
+            else:
+                # the nearest blocker is the highest set bit, keep the ray down to it
+                smear = hit.copy()
+                for shift in (1, 2, 4, 8, 16, 32):
+                    smear |= smear >> np.uint64(shift)
+                first = smear ^ (smear >> one)
+                seen = ray & ~(first - one)
+            seen = np.where(hit == 0, ray, seen)
+            if d in cls.ORTHOGONAL:
+                orthogonal |= seen
+            else:
+                diagonal |= seen
+
+        return np.select([types == 1, types == 2, types == 3],
+                         [orthogonal | diagonal, orthogonal, diagonal],
+                         cls.STEPS[types, squares])
+
+    @classmethod
+    def captures(cls, occ, types, caps):
+        """Computes the legal captures of a batch of positions
+
+        Args:
+            occ: (N,) uint64 occupancy masks
+            types: (N, 64) piece types
+            caps: (N, 64) captures left
+
+        Returns:
+            (N, 64) uint64, bit j of entry [k, i] is set if the piece on square i can capture the piece on square j in position k
+        """
+        # kings cannot be captured
+        kings = np.bitwise_or.reduce(np.where(types == 6, np.uint64(1) << np.arange(64, dtype=np.uint64), np.uint64(0)), axis=1)
+        targets = occ & ~kings
+        moves = cls.attacks(occ, types) & targets[:, None]
+        return np.where(caps > 0, moves, np.uint64(0))
+
+    @classmethod
+    def matrix(cls, moves):
+        """Unpacks the result of cls.captures
+
+        Returns:
+            (N, 64, 64) bool, entry [k, i, j] is True if the piece on square i can capture the piece on square j in position k
+        """
+        return np.unpackbits(moves.astype("<u8").view(np.uint8), axis=-1, bitorder="little").reshape(moves.shape + (64,)).astype(bool)
+
+    @classmethod
+    def counts(cls, moves):
+        """Returns the number of legal captures of every position, (N,) int
+        """
+        return cls.matrix(moves).sum(axis=(1, 2))
+
+    @classmethod
+    def kingStuck(cls, moves, types):
+        """Returns for every position whether its king makes no capture, (N,) bool, see State.kingStuck
+        """
+        return ~((moves != 0) & (types == 6)).any(axis=1)
+
+    @classmethod
+    def terminal(cls, occ, types, caps):
+        """Returns for every position whether it is terminal, (N,) bool, see State.isTerminal
+        """
+        moves = cls.captures(occ, types, caps)
+        single = (types != 0).sum(axis=1) == 1
+        return single | ~(moves != 0).any(axis=1) | cls.kingStuck(moves, types)
@@ -0,0 +1,139 @@
+from mcts import Node
+from state import State
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+
+class Beam():
+    """Beam search over the layers of a Solo Chess puzzle
+
+    Every solution makes exactly n - 1 captures, so layer d holds the states after d captures.
+    Each layer keeps the k best states, scored by the sum of the evaluations of the captures leading to them.
+    States reached in several ways are merged, keeping the best score. Memory is bounded by k states per layer.
+
+    Attributes:
+        root: the node of the starting state
+        visited: the number of states expanded
+        tree: the set of states kept in the beams
+        goal: the goal node, once found
+    """
+    def __init__(self, s0, k = 100, h = "R", evaluate = None, workers = None):
+        """Initialises an instance of Beam
+
+        Args:
+            s0: the starting state
+            k = 100: the beam width
+            h = "R": heuristic used to evaluate captures when no evaluator is given, None scores all captures equally
+            evaluate = None: a function (s, a, s2) -> float evaluating capture a from state s to state s2, higher is better.
+                Has to be picklable when workers are used.
+            workers = None: the number of worker processes expanding each layer, None or 1 expands in this process
+        """
+        self.root = Node(s0, None, None)
+        self.k = k
+        self.h = h
+        self.evaluate = evaluate
+        self.workers = workers
+
+        self.visited = 0
+        self.tree = {s0}
+        self.goal = None
+
+    def run(self):
+        """Runs the beam search until a goal node is found or the beam is empty
+
+        Returns:
+            The list of nodes from the root to the goal node, or None if no solution was found
+        """
+        if self.root.s.isGoal():
+            self.goal = self.root
+            return self.goal.getRoute()
+
+        executor = ProcessPoolExecutor(self.workers) if self.workers is not None and self.workers > 1 else None
+        try:
+            # (score, node) pairs
+            layer = [(0, self.root)]
+            while len(layer) > 0:
+                layer = self.step(layer, executor)
+                if self.goal is not None:
+                    return self.goal.getRoute()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return None
+
+    def step(self, layer, executor = None):
+        """Expands a layer into the next one
+
+        Args:
+            layer: list of (score, node) pairs
+            executor = None: an executor to expand the states with
+
+        Returns:
+            The next layer, of at most self.k pairs. If a goal node is among the children it is stored in self.goal
+        """
+        states = [node.s for (score, node) in layer]
+        self.visited += len(states)
+
+        if executor is None:
+            expansions = Beam.expandAll(states, self.h, self.evaluate)
+        else:
+            # states travel as State.toBytes encodings, children come back encoded and are only decoded if kept
+            n = -(-len(states) // self.workers)
+            chunks = [State.packMany(states[i:i + n]) for i in range(0, len(states), n)]
+            expansions = [e for part in executor.map(Beam.expandPacked, chunks, [self.h] * len(chunks), [self.evaluate] * len(chunks)) for e in part]
+
+        # best entry per state, keyed by the state or by its encoding which identifies it as well
+        best = dict()
+        for (score, node), children in zip(layer, expansions):
+            s = node.s
+            for (q1, q2), s2, value in children:
+                if (len(s2) - 8 if isinstance(s2, bytes) else len(s2.ps)) == 1:
+                    # only the king can be left
+                    s2 = State.fromBytes(s2) if isinstance(s2, bytes) else s2
+                    self.goal = Node(s2, node, (s.topiece[q1], s.topiece[q2]))
+                    return []
+                entry = best.get(s2)
+                if entry is None or score + value > entry[0]:
+                    best[s2] = (score + value, node, (q1, q2))
+
+        # ties keep the order of the layer and of State.getActions, which only depend on the states, so workers keep the same layers
+        kept = heapq.nlargest(self.k, best.items(), key=lambda item: item[1][0])
+
+        layer = []
+        for s2, (score, node, (q1, q2)) in kept:
+            s2 = State.fromBytes(s2) if isinstance(s2, bytes) else s2
+            layer.append((score, Node(s2, node, (node.s.topiece[q1], node.s.topiece[q2]))))
+            self.tree.add(s2)
+        return layer
+
+    @classmethod
+    def expandAll(cls, states, h, evaluate = None):
+        """Generates and evaluates the children of states
+
+        Runs in worker processes, so actions are returned by their squares instead of their pieces.
+
+        Args:
+            states: list of states to expand
+            h: heuristic used when evaluate is None, may be None
+            evaluate = None: a function (s, a, s2) -> float
+
+        Returns:
+            Per state a list of ((from-square, to-square), child state, value) tuples, empty for terminal states
+        """
+        expansions = []
+        for s in states:
+            children = []
+            for (p1, p2) in s.getLiveActions():
+                s2 = s.nextState(p1, p2)
+                if evaluate is not None:
+                    value = evaluate(s, (p1, p2), s2)
+                else:
+                    value = s.heuristic(h, p1, p2) if h is not None else 0
+                children.append(((s.square[p1], s.square[p2]), s2, value))
+            expansions.append(children)
+        return expansions
+
+    @classmethod
+    def expandPacked(cls, buf, h, evaluate = None):
+        """Like cls.expandAll, for states packed with State.packMany, returning the children as State.toBytes encodings
+        """
+        return [[(a, s2.toBytes(), value) for a, s2, value in children] for children in cls.expandAll(State.unpackMany(buf), h, evaluate)]
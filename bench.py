@@ -0,0 +1,215 @@
+from mcts import MCTS, Node
+from generator import Generator
+from corpus import Corpus
+from solve import Solver
+from state import State
+from utils import Utils
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+class Bench():
+    """Reproducible benchmarks of the hot paths and of full solves
+
+    Micro-benchmarks time single calls of the functions the solvers spend their time in, on a fixed position.
+    Macro-benchmarks solve the pinned corpus in benchmarks/corpus.fen, which has puzzles for every piece count from 5 to 14.
+    Results are plain dictionaries that are stored as JSON and compared against a stored baseline.
+    """
+
+    corpus = "benchmarks/corpus.fen"
+
+    # fixed 14-piece position used by the micro-benchmarks
+    fen = "7R/5KQB/5PRP/4Q3/4Q1Q1/2B5/4B3/4Q1R1"
+
+    # metrics of the macro-benchmarks for which lower is better
+    metrics = ["wall", "cpu", "visited"]
+
+    # solve times in seconds below which differences are timer noise
+    floor = 0.01
+
+    @classmethod
+    def micro(cls, repeat = 5):
+        """Runs the micro-benchmarks
+
+        Args:
+            repeat = 5: the number of timing runs, the fastest is reported
+
+        Returns:
+            A dictionary from benchmark name to microseconds per call
+        """
+        s = State.fromFen(cls.fen)
+        actions = s.getActions()
+        p1, p2 = actions[0]
+        q1, q2 = s.square[p1], s.square[p2]
+        s2 = s.nextState(p1, p2)
+        s3 = State.fromFen(cls.fen)
+        encoded = s.toBytes()
+        g = Generator()
+
+        # a node with statistics, as during selection
+        root = Node(s)
+        root.visits = 100
+        node = Node(s2, root, (p1, p2))
+        node.wins = 12.5
+        node.visits = 20
+        mcts = MCTS(s)
+
+        cases = {
+            "Utils.canReach": lambda: Utils.canReach(p1, q1, q2, s.qs),
+            "State.getActions": s.getActions,
+            "State.nextState": lambda: s.nextState(p1, p2),
+            "State.__hash__": s.__hash__,
+            "State.__eq__": lambda: s == s3,
+            "State.toBytes": s.toBytes,
+            "State.fromBytes": lambda: State.fromBytes(encoded),
+            "Generator.generate": lambda: g.generate(14),
+            "MCTS.uct": lambda: mcts.uct(node)
+        }
+
+        results = dict()
+        for name, f in cases.items():
+            timer = timeit.Timer(f)
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat, number))
+            results[name] = best / number * 1e6
+        return results
+
+    @classmethod
+    def macro(cls, solvers, params, pieces = (5, 14), timeout = 60, seed = 0, workers = 1):
+        """Runs the macro-benchmarks
+
+        Every solver solves every puzzle of the pinned corpus with the given piece counts.
+        Every solve gets its own random stream derived from seed, so runs are reproducible at any worker count.
+
+        Args:
+            solvers: a list of keys of Solver.solvers
+            params: a dictionary of solver parameters, see Solver.make
+            pieces = (5, 14): inclusive range of piece counts
+            timeout = 60: time limit per solve in seconds
+            seed = 0: seed from which the per-puzzle seeds are derived
+            workers = 1: the number of worker processes, timings are only comparable at equal worker counts
+
+        Returns:
+            A dictionary from solver to piece count to aggregated measurements:
+            medians of wall, cpu and visited, and the number of puzzles solved
+        """
+        states = [s for s in Corpus.read(cls.corpus) if pieces[0] <= len(s.ps) <= pieces[1]]
+
+        results = dict()
+        for name in solvers:
+            runs = dict()
+            for result in Solver.solveAll(states, name, params, workers, timeout, seed = seed):
+                runs.setdefault(result["n"], []).append(result)
+
+            results[name] = {
+                str(n): {
+                    "wall": statistics.median(r["wall"] for r in rs),
+                    "cpu": statistics.median(r["cpu"] for r in rs),
+                    "visited": statistics.median(r["visited"] for r in rs),
+                    "solved": sum(r["status"] == "solved" for r in rs),
+                    "count": len(rs)
+                }
+                for n, rs in sorted(runs.items())
+            }
+        return results
+
+    @classmethod
+    def compare(cls, results, baseline, threshold):
+        """Compares results against a baseline
+
+        Args:
+            results: a results dictionary as written by main()
+            baseline: a results dictionary to compare against
+            threshold: relative slowdown above which a measurement counts as a regression, e.g. 0.1 for 10%
+
+        Returns:
+            A list of (name, baseline value, new value, relative change, regressed) tuples
+        """
+        rows = []
+
+        def add(name, old, new):
+            change = (new - old) / old if old > 0 else 0
+            rows.append((name, old, new, change, change > threshold))
+
+        for name, new in results.get("micro", dict()).items():
+            if name in baseline.get("micro", dict()):
+                add(name, baseline["micro"][name], new)
+
+        for solver, ns in results.get("macro", dict()).items():
+            for n, new in ns.items():
+                old = baseline.get("macro", dict()).get(solver, dict()).get(n)
+                if old is None:
+                    continue
+                for metric in cls.metrics:
+                    if metric != "visited" and max(old[metric], new[metric]) < cls.floor:
+                        continue
+                    add(f"{solver}/{n}/{metric}", old[metric], new[metric])
+                # fewer solves within the time limit is always a regression
+                if new["solved"] < old["solved"]:
+                    rows.append((f"{solver}/{n}/solved", old["solved"], new["solved"], -1, True))
+
+        return rows
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare it against a baseline")
+    parser.add_argument("--micro", action="store_true", help="only run the micro-benchmarks")
+    parser.add_argument("--macro", action="store_true", help="only run the macro-benchmarks")
+    parser.add_argument("--solvers", nargs="+", choices=sorted(Solver.solvers), default=["mcts", "backtrack", "bestfirst"])
+    parser.add_argument("--pieces", type=int, nargs=2, default=[5, 14], metavar=("LOW", "HIGH"))
+    parser.add_argument("--timeout", type=float, default=60, help="time limit per solve in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per micro-benchmark")
+    parser.add_argument("--out", default="benchmarks/results.json", help="file to write the results to")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json", help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    both = not args.micro and not args.macro
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": args.seed,
+            "workers": args.workers,
+            "timeout": args.timeout
+        }
+    }
+
+    if args.micro or both:
+        results["micro"] = Bench.micro(args.repeat)
+    if args.macro or both:
+        params = {"h": "R", "c": 2, "d": 3, "_tree": False}
+        results["macro"] = Bench.macro(args.solvers, params, args.pieces, args.timeout, args.seed, args.workers)
+
+    with open(args.out, "w") as file:
+        json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        return 0
+
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        print(f"no baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    regressions = 0
+    for name, old, new, change, regressed in Bench.compare(results, baseline, args.threshold):
+        regressions += regressed
+        print(f"{'REGRESSION' if regressed else '':10} {name:32} {old:12.3f} {new:12.3f} {change:+8.1%}")
+    print(f"{regressions} regressions above {args.threshold:.0%}")
+    return 1 if regressions > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
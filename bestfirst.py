@@ -0,0 +1,106 @@
+from mcts import Node
+import heapq
+import itertools
+
+class BestFirst():
+    """Best-first search over the states of a Solo Chess puzzle
+
+    All generated states wait in one frontier, a heap ordered by weight * depth + the evaluation of the capture leading to the state,
+    and the best one anywhere in the search is expanded next. Every solution makes exactly n - 1 captures, so the depth term plays
+    the role of the cost so far of weighted A*: a large weight dives like depth-first search, a weight of 0 is greedy on the evaluation.
+    States are generated once, duplicates being recognised by the transposition set.
+    With a cap, the frontier is trimmed to its best entries whenever it grows beyond cap, so memory is bounded at the price of completeness.
+
+    Attributes:
+        root: the node of the starting state
+        visited: the number of states expanded
+        tree: the set of states generated
+        goal: the goal node, once found
+        dropped: the number of frontier entries dropped by trimming
+    """
+    def __init__(self, s0, h = "R", evaluate = None, weight = 1, cap = None):
+        """Initialises an instance of BestFirst
+
+        Args:
+            s0: the starting state
+            h = "R": heuristic used to evaluate captures when no evaluator is given, None scores all captures equally
+            evaluate = None: a function (s, a, s2) -> float evaluating capture a from state s to state s2, higher is better, e.g. an Evaluator
+            weight = 1: weight of the depth of a state in its priority
+            cap = None: the maximum number of frontier entries, unbounded if None
+        """
+        self.root = Node(s0, None, None)
+        self.h = h
+        self.evaluate = evaluate
+        self.weight = weight
+        self.cap = cap
+
+        self.visited = 0
+        self.tree = {s0}
+        self.goal = None
+        self.dropped = 0
+
+    def run(self):
+        """Expands the best frontier state until a goal node is found or the frontier is empty
+
+        Returns:
+            The list of nodes from the root to the goal node, or None if no solution was found
+        """
+        if self.root.s.isGoal():
+            self.goal = self.root
+            return self.goal.getRoute()
+
+        # (-priority, tie breaker, depth, node), the counter keeps equal priorities first in first out
+        counter = itertools.count()
+        frontier = [(0, next(counter), 0, self.root)]
+        while len(frontier) > 0:
+            _, _, depth, node = heapq.heappop(frontier)
+            self.visited += 1
+            for child, value in self.expand(node):
+                if len(child.s.ps) == 1:
+                    # only the king can be left
+                    self.goal = child
+                    return self.goal.getRoute()
+                heapq.heappush(frontier, (-(self.weight * (depth + 1) + value), next(counter), depth + 1, child))
+
+            if self.cap is not None and len(frontier) > self.cap:
+                frontier = self.trim(frontier)
+        return None
+
+    def expand(self, node: Node):
+        """Generates the new children of a node with their evaluations
+
+        Args:
+            node: the node to expand
+
+        Returns:
+            A list of (child node, value) pairs, leaving out children whose state was generated before
+        """
+        s = node.s
+        children = []
+        for (p1, p2) in s.getLiveActions():
+            s2 = s.nextState(p1, p2)
+            if s2 in self.tree:
+                continue
+            self.tree.add(s2)
+            if self.evaluate is not None:
+                value = self.evaluate(s, (p1, p2), s2)
+            elif self.h is not None:
+                value = s.heuristic(self.h, p1, p2)
+            else:
+                value = 0
+            children.append((Node(s2, node, (p1, p2)), value))
+        return children
+
+    def trim(self, frontier):
+        """Keeps the best three quarters of cap entries of the frontier, so trimming happens once every cap / 4 insertions at most
+
+        Args:
+            frontier: the heap of frontier entries
+
+        Returns:
+            A new heap of the best entries
+        """
+        keep = heapq.nsmallest(self.cap - self.cap // 4, frontier)
+        self.dropped += len(frontier) - len(keep)
+        # a sorted list is a heap
+        return keep
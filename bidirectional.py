@@ -0,0 +1,208 @@
+from backtrack import Backtrack
+from mcts import Node
+from utils import Utils
+from collections import Counter
+
+class Bidirectional(Backtrack):
+    """Bidirectional search, meeting a backward search from the goal with depth-first search from the start
+
+    The backward search grows layers of positions from which the goal can be reached, starting from the possible goal states:
+    the king alone on a square of the starting position (the last capture is the king's, so it ends on a square some other piece stood on).
+    A position of layer m has m pieces and its predecessors are found by undoing a capture: a piece moves back to a square it could have
+    captured from, see Utils.expansions, gets its capture back, and a captured piece is placed on the square it left.
+    Only positions consistent with the starting position are kept:
+        - all pieces stand on squares of the starting position and no type occurs more often than there
+        - a piece with as many captures left as any piece of its type started with has not moved, so it stands on its starting square
+        - the king can capture, otherwise the position is lost
+    Positions are stored by their State.toBytes encoding, which identifies them like State equality does, together with the capture
+    leading one layer closer to the goal.
+
+    The forward search is Backtrack with heuristic ordering. A state found in the backward table is completed to a goal by replaying the
+    stored captures. If the backward search finished layer m without hitting the limit, the layer holds every position with m pieces
+    from which the goal can be reached, so a forward state with m pieces outside it is a dead end and is cut off.
+    Puzzles with pieces off the 8x8 board are solved by the forward search alone.
+
+    Attributes:
+        reverse: a dictionary from encoding to (encoding one capture closer to the goal, (from square, to square)), None for goal states
+        complete: the largest number of pieces whose layer is complete, 0 if none
+        meetings: 1 if the forward search reached the backward table, else 0
+        pruned: the number of forward states cut off by a complete layer
+    """
+    def __init__(self, s0, h = "R", _tree = True, limit = None, depth = None, reverse = 2000):
+        """Initialises an instance of Bidirectional
+
+        Args:
+            s0: the starting state
+            h = "R": heuristic used to order the forward search
+            _tree = True: whether the forward search uses a transposition set
+            limit = None: optional cap on visited forward nodes
+            depth = None: the maximum number of captures undone by the backward search, as many as fit in the reverse limit if None
+            reverse = 2000: the maximum number of positions stored by the backward search
+        """
+        super().__init__(s0, h, _tree, limit)
+        self.depth = depth
+        self.maxReverse = reverse
+        self.reverse = dict()
+        self.complete = 0
+        self.meetings = 0
+        self.pruned = 0
+
+    def run(self):
+        """Grows the backward layers, then searches forward until the table is reached
+
+        Returns:
+            The list of nodes from the root to the goal node, or None if no solution was found
+        """
+        self.prepare()
+        return super().run()
+
+    def step(self, k):
+        """Advances the forward search by at most k visited nodes, growing the backward layers first, see Backtrack.step
+        """
+        if self.search is None:
+            self.prepare()
+        return super().step(k)
+
+    def prepare(self):
+        """Grows the backward layers, unless the puzzle has pieces off the board
+        """
+        s0 = self.s0
+        if all(0 <= q.x <= 7 and 0 <= q.y <= 7 for q in s0.qs) and len(s0.ps) > 1:
+            self.backward()
+
+    def backward(self):
+        """Grows the layers of the backward search into self.reverse and sets self.complete
+        """
+        s0 = self.s0
+        n0 = len(s0.ps)
+        # the piece on every square of the starting position, as type and captures left
+        start = {Utils.toIndex(q): (p.type, s0.caps[p]) for p, q in s0.square.items()}
+        squares = Utils.toMask(s0.qs)
+        types = Counter(t for t, c in start.values())
+        # the most captures any piece of a type starts with
+        fresh = dict()
+        for t, c in start.values():
+            fresh[t] = max(fresh.get(t, 0), c)
+
+        kings = [i for i, (t, c) in start.items() if t == 6]
+        if len(kings) != 1:
+            return
+        home = kings[0]
+
+        # goal states: the king made at least one capture and stands on a square another piece started on
+        layer = []
+        for i in Utils.bits(squares & ~(1 << home)):
+            for c in range(fresh[6]):
+                pieces = {i: (6, c)}
+                key = Bidirectional.encode(1 << i, pieces)
+                self.reverse[key] = None
+                layer.append((1 << i, pieces, key))
+        self.complete = 1
+
+        m = 1
+        while m < n0 - 1 and (self.depth is None or m <= self.depth):
+            nexts = []
+            for occ, pieces, key in layer:
+                for item in self.uncaptures(occ, pieces, start, squares, types, fresh):
+                    if item[2] in self.reverse:
+                        continue
+                    if len(self.reverse) >= self.maxReverse:
+                        return
+                    self.reverse[item[2]] = (key, item[3])
+                    nexts.append(item[:3])
+            layer = nexts
+            m += 1
+            self.complete = m
+            if len(layer) == 0:
+                return
+
+    def uncaptures(self, occ, pieces, start, squares, types, fresh):
+        """Generates the consistent predecessors of a backward position
+
+        Args:
+            occ: the bitmask of occupied squares
+            pieces: a dictionary from square index to (type, captures left)
+            start: the same dictionary for the starting position
+            squares: the bitmask of the squares of the starting position
+            types: a Counter of the types of the starting position
+            fresh: a dictionary from type to the most captures a piece of that type starts with
+
+        Yields:
+            (occ, pieces, encoding, (from square, to square)) tuples, the capture leading from the predecessor to the given position
+        """
+        left = types - Counter(t for t, c in pieces.values())
+        captured = [(t, c) for t in left if t != 6 for c in range(fresh[t] + 1)]
+
+        for i, (t, c) in pieces.items():
+            if c >= fresh[t]:
+                continue
+            for j in Utils.bits(Utils.expansions(t, i, occ) & squares):
+                # the capturing piece has its capture back, if that makes it fresh it must be on its starting square
+                if c + 1 == fresh[t] and start[j] != (t, c + 1):
+                    continue
+                for (t2, c2) in captured:
+                    if c2 == fresh[t2] and start[i] != (t2, c2):
+                        continue
+                    occ2 = occ | 1 << j
+                    pieces2 = dict(pieces)
+                    pieces2[i] = (t2, c2)
+                    pieces2[j] = (t, c + 1)
+                    if not Bidirectional.kingCaptures(occ2, pieces2):
+                        continue
+                    yield occ2, pieces2, Bidirectional.encode(occ2, pieces2), (j, i)
+
+    @classmethod
+    def kingCaptures(cls, occ, pieces):
+        """Returns whether the king of a position has a capture, see State.kingStuck
+        """
+        for i, (t, c) in pieces.items():
+            if t == 6:
+                return c > 0 and Utils.attacks(6, i, occ) & occ & ~(1 << i) != 0
+        return False
+
+    @classmethod
+    def encode(cls, occ, pieces):
+        """Encodes a backward position like State.toBytes
+
+        Args:
+            occ: the bitmask of occupied squares
+            pieces: a dictionary from square index to (type, captures left)
+
+        Returns:
+            A bytes object
+        """
+        return occ.to_bytes(8, "little") + bytes(pieces[i][0] << 4 | pieces[i][1] for i in sorted(pieces))
+
+    def walk(self, node: Node):
+        n = len(node.s.ps)
+        # the backward table holds positions of up to one piece more than its complete layers
+        if len(self.reverse) > 0 and n <= self.complete + 1:
+            key = node.s.toBytes()
+            if key in self.reverse:
+                self.visited += 1
+                self.meetings = 1
+                self.goal = self.join(node, key)
+                return True
+            if n <= self.complete:
+                self.visited += 1
+                self.pruned += 1
+                return False
+        return (yield from super().walk(node))
+
+    def join(self, node: Node, key):
+        """Completes a route from a state in the backward table to the goal
+
+        Args:
+            node: the node of a state whose encoding is in self.reverse
+            key: that encoding
+
+        Returns:
+            The goal node
+        """
+        while self.reverse[key] is not None:
+            key, (i, j) = self.reverse[key]
+            s = node.s
+            p1, p2 = s.topiece[Utils.fromIndex(i)], s.topiece[Utils.fromIndex(j)]
+            node = Node(s.nextState(p1, p2), node, (p1, p2))
+            self.tree.add(node.s)
+        return node
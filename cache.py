@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import time
+
+class SolutionCache():
+    """A persistent cache of solved puzzles, shared by processes through an SQLite file
+
+    Puzzles are keyed by their canonical text form, State.toFen, so equal states hit the same entry whatever their piece objects.
+    Each entry holds the solution as moves (see Solver.moves), the solver and parameters that found it and what the search cost.
+    The database runs in write-ahead-log mode, so any number of processes can read while one writes.
+    Every process opens its own connection, and a cache pickles as its path so it can be handed to worker processes.
+
+    Attributes:
+        fn: the path of the database file
+        hits: the number of lookups that found an entry in this process
+        misses: the number of lookups that did not
+    """
+
+    schema = """CREATE TABLE IF NOT EXISTS solutions (
+        fen TEXT PRIMARY KEY,
+        moves TEXT NOT NULL,
+        solver TEXT,
+        params TEXT,
+        visited INTEGER,
+        wall REAL,
+        created REAL
+    )"""
+
+    def __init__(self, fn, timeout = 30):
+        """Opens or creates a cache
+
+        Args:
+            fn: the path of the database file
+            timeout = 30: seconds to wait for another process holding the write lock
+        """
+        self.fn = fn
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        self.open()
+
+    def open(self):
+        """Connects to the database and creates the table if needed
+        """
+        if self.conn is not None:
+            return
+        self.conn = sqlite3.connect(self.fn, timeout=self.timeout, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SolutionCache.schema)
+
+    def close(self):
+        """Closes the connection
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    @classmethod
+    def key(cls, s):
+        """Returns the key of a state, or None if the state cannot be written as FEN (pieces off the board)
+        """
+        try:
+            return s.toFen()
+        except ValueError:
+            return None
+
+    def get(self, s):
+        """Looks up the solution of a state
+
+        Args:
+            s: the starting state
+
+        Returns:
+            A dictionary with moves, solver, params, visited and wall, or None if the state is not in the cache
+        """
+        key = SolutionCache.key(s)
+        row = None
+        if key is not None:
+            row = self.conn.execute("SELECT moves, solver, params, visited, wall FROM solutions WHERE fen = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        moves, solver, params, visited, wall = row
+        return {
+            "moves": json.loads(moves),
+            "solver": solver,
+            "params": json.loads(params) if params is not None else None,
+            "visited": visited,
+            "wall": wall
+        }
+
+    def put(self, s, moves, solver = None, params = None, visited = None, wall = None):
+        """Stores the solution of a state, keeping an existing entry
+
+        Args:
+            s: the starting state
+            moves: the solution as a list of moves
+            solver = None: the name of the solver that found it
+            params = None: a JSON-serialisable dictionary of the solver's parameters
+            visited = None: the number of states the solver visited
+            wall = None: the time the solver took in seconds
+
+        Returns:
+            True if the entry was added
+        """
+        key = SolutionCache.key(s)
+        if key is None:
+            return False
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO solutions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(moves), solver, json.dumps(params, default=str) if params is not None else None, visited, wall, time.time()))
+        return cur.rowcount == 1
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def __contains__(self, s):
+        key = SolutionCache.key(s)
+        return key is not None and self.conn.execute("SELECT 1 FROM solutions WHERE fen = ?", (key,)).fetchone() is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # worker processes open their own connection
+        return {"fn": self.fn, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state["fn"], state["timeout"])
@@ -0,0 +1,280 @@
+from state import State
+import argparse
+import mmap
+import struct
+import sys
+
+class Corpus():
+    """A read-only collection of puzzles stored in a compact binary file
+
+    The file is memory-mapped, so opening it costs next to nothing and worker processes opening the same
+    file share its pages. States are only decoded when they are accessed, by index or by iterating.
+
+    Layout of a corpus file, all integers little-endian:
+        header: magic, version, record size, max pieces, padding, record count, index offset (see Corpus.header)
+        records: one fixed-width record per puzzle, record i starts at header size + i * record size
+        index: for every piece count n from 0 to max pieces the position of its first entry (uint32),
+            followed by the record numbers grouped by piece count (uint32)
+
+    A record consists of the occupied squares as a 64-bit mask (bit 8*y + x) followed by one byte per piece,
+    in increasing square order, holding the type in the high four bits and the captures left in the low four.
+    This is the encoding of State.toBytes, padded with zero bytes to the record size.
+
+    The classmethods readFen and writeFen stream the line-based interchange format of State.fromFen instead.
+
+    Attributes:
+        fn: the path of the corpus file
+        count: the number of puzzles in the corpus
+    """
+
+    magic = b"SCPZ"
+    version = 1
+    header = struct.Struct("<4sHHHHIQ")
+    occupancy = struct.Struct("<Q")
+    maxPieces = 16
+    recordSize = occupancy.size + maxPieces
+
+    @classmethod
+    def pack(cls, s) -> bytes:
+        """Encodes a state as a corpus record
+
+        Args:
+            s: the state to encode, all its pieces have to be on the 8x8 board
+
+        Returns:
+            The record as a bytes object of length cls.recordSize
+        """
+        if len(s.ps) > cls.maxPieces:
+            raise ValueError(f"a corpus record holds at most {cls.maxPieces} pieces, got {len(s.ps)}")
+
+        # a record is State.toBytes padded to a fixed width
+        return s.toBytes().ljust(cls.recordSize, b"\0")
+
+    @classmethod
+    def unpack(cls, buf, offset = 0):
+        """Decodes a corpus record into a state
+
+        Args:
+            buf: a buffer holding the record
+            offset = 0: the position of the record in buf
+
+        Returns:
+            A new State object
+        """
+        return State.fromBytes(buf, offset)
+
+    @classmethod
+    def write(cls, fn, states):
+        """Writes puzzles to a new corpus file
+
+        States are consumed one at a time, so states may be a generator producing a large corpus.
+
+        Args:
+            fn: the path of the file to create
+            states: an iterable of starting states
+
+        Returns:
+            The number of puzzles written
+        """
+        groups = [[] for _ in range(cls.maxPieces + 1)]
+        count = 0
+
+        with open(fn, "wb") as file:
+            file.write(bytes(cls.header.size))
+            for s in states:
+                file.write(cls.pack(s))
+                groups[len(s.ps)].append(count)
+                count += 1
+
+            # index: start of every group, then the grouped record numbers
+            offset = cls.header.size + count * cls.recordSize
+            starts = []
+            total = 0
+            for g in groups:
+                starts.append(total)
+                total += len(g)
+            file.write(struct.pack(f"<{len(starts)}I", *starts))
+            for g in groups:
+                file.write(struct.pack(f"<{len(g)}I", *g))
+
+            file.seek(0)
+            file.write(cls.header.pack(cls.magic, cls.version, cls.recordSize, cls.maxPieces, 0, count, offset))
+
+        return count
+
+    @classmethod
+    def readFen(cls, src):
+        """Streams states from FEN-like lines, one puzzle per line
+
+        Lines are parsed as they are read, so the whole input is never held in memory.
+        Empty lines and lines starting with # are skipped.
+
+        Args:
+            src: a path, "-" for standard input, or an open text file
+
+        Yields:
+            State objects, see State.fromFen for the line format
+        """
+        if isinstance(src, str):
+            if src == "-":
+                yield from cls.readFen(sys.stdin)
+                return
+            with open(src) as file:
+                yield from cls.readFen(file)
+            return
+
+        for line in src:
+            if line.strip() == "" or line.startswith("#"):
+                continue
+            yield State.fromFen(line)
+
+    @classmethod
+    def writeFen(cls, dst, states):
+        """Writes states as FEN-like lines, one puzzle per line
+
+        Args:
+            dst: a path, "-" for standard output, or an open text file
+            states: an iterable of states, consumed one at a time
+
+        Returns:
+            The number of puzzles written
+        """
+        if isinstance(dst, str):
+            if dst == "-":
+                return cls.writeFen(sys.stdout, states)
+            with open(dst, "w") as file:
+                return cls.writeFen(file, states)
+
+        count = 0
+        for s in states:
+            dst.write(s.toFen() + "\n")
+            count += 1
+        return count
+
+    @classmethod
+    def read(cls, src):
+        """Streams the puzzles of a binary corpus or a FEN-like text file
+
+        The format is detected from the first bytes of the file, standard input is always read as text.
+
+        Args:
+            src: a path or "-" for standard input
+
+        Yields:
+            State objects
+        """
+        if src != "-":
+            with open(src, "rb") as file:
+                binary = file.read(len(cls.magic)) == cls.magic
+            if binary:
+                with Corpus(src) as c:
+                    yield from c
+                return
+        yield from cls.readFen(src)
+
+    def __init__(self, fn):
+        """Opens a corpus file
+
+        Args:
+            fn: the path of the corpus file
+        """
+        self.fn = fn
+        self.open()
+
+    def open(self):
+        """Maps the corpus file into memory and reads its header
+        """
+        with open(self.fn, "rb") as file:
+            self.buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, size, maxPieces, _, self.count, self.indexOffset = Corpus.header.unpack_from(self.buf, 0)
+        if magic != Corpus.magic or version != Corpus.version:
+            raise ValueError(f"{self.fn} is not a version {Corpus.version} puzzle corpus")
+        if size != Corpus.recordSize or maxPieces != Corpus.maxPieces:
+            raise ValueError(f"{self.fn} has an unsupported record layout")
+
+        groups = Corpus.maxPieces + 1
+        self.starts = struct.unpack_from(f"<{groups}I", self.buf, self.indexOffset)
+        self.ids = memoryview(self.buf)[self.indexOffset + 4 * groups:].cast("I")
+
+    def close(self):
+        """Unmaps the corpus file
+        """
+        self.ids.release()
+        self.buf.close()
+
+    def select(self, n):
+        """Returns the record numbers of all puzzles with n pieces
+
+        Args:
+            n: the number of pieces
+
+        Returns:
+            A list of record numbers, in the order they were written
+        """
+        if not 0 <= n <= Corpus.maxPieces:
+            return []
+        end = self.starts[n + 1] if n < Corpus.maxPieces else len(self.ids)
+        # a copy, a view into the map would keep self.close from unmapping it
+        return self.ids[self.starts[n]:end].tolist()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        """Decodes the puzzle with record number i
+        """
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("corpus index out of range")
+        return Corpus.unpack(self.buf, Corpus.header.size + i * Corpus.recordSize)
+
+    def __iter__(self):
+        """Lazily decodes all puzzles in record order
+        """
+        for i in range(self.count):
+            yield Corpus.unpack(self.buf, Corpus.header.size + i * Corpus.recordSize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # worker processes map the file themselves instead of receiving a copy
+        return {"fn": self.fn}
+
+    def __setstate__(self, state):
+        self.fn = state["fn"]
+        self.open()
+
+
+def main(argv = None):
+    """Generates a fixed benchmark corpus
+
+    The corpus is written in the binary format, or as FEN-like lines when the file name ends in .fen or is "-".
+    """
+    from generator import Generator
+
+    parser = argparse.ArgumentParser(description="Generate a binary corpus of Solo Chess puzzles")
+    parser.add_argument("fn", help="the corpus file to write, - writes FEN-like lines to standard output")
+    parser.add_argument("--pieces", type=int, nargs=2, default=[5, 14], metavar=("LOW", "HIGH"),
+                        help="inclusive range of piece counts")
+    parser.add_argument("--count", type=int, default=100, help="puzzles per piece count")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the generator")
+    args = parser.parse_args(argv)
+
+    gen = Generator(args.seed)
+    low, high = args.pieces
+    states = (gen.getPuzzle(n) for n in range(low, high + 1) for _ in range(args.count))
+    if args.fn == "-" or args.fn.endswith(".fen"):
+        count = Corpus.writeFen(args.fn, states)
+    else:
+        count = Corpus.write(args.fn, states)
+    print(f"wrote {count} puzzles to {args.fn}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
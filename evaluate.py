@@ -0,0 +1,172 @@
+from utils import Utils
+
+class Evaluator():
+    """Static evaluation of positions, used to cut rollouts short
+
+    A position is described by a few features, and its value is a linear combination of them,
+    estimating the value the rollout would have reached when played to the end (see MCTS.simulate).
+    The weights can be fitted by least squares to samples logged from full rollouts, see Evaluator.collect and Evaluator.fit.
+
+    Features, all between 0 and 1:
+        progress: the fraction of the pieces of the starting position that has been captured
+        reach: the fraction of the other pieces connected to the king in the capture graph, whose edges are the legal captures
+        caps: the captures left of all pieces relative to the 2 captures per piece of a fresh position
+        mobility: the number of captures the king can make relative to the other pieces
+        isolated: the fraction of the pieces that can neither capture nor be captured
+
+    Attributes:
+        weights: the bias followed by one weight per feature
+    """
+
+    names = ["progress", "reach", "caps", "mobility", "isolated"]
+
+    # fitted on heuristic rollouts of generated 8 to 14 piece puzzles, cut after 3 captures
+    default = [0.79, -0.34, -0.09, 0.03, 0.31, -0.35]
+
+    def __init__(self, weights = None):
+        """Initialises an instance of Evaluator
+
+        Args:
+            weights = None: the bias followed by one weight per feature, Evaluator.default if None
+        """
+        self.weights = list(weights) if weights is not None else list(Evaluator.default)
+
+    def features(self, s, n0, actions = None):
+        """Computes the features of a position
+
+        Args:
+            s: the state to describe
+            n0: the number of pieces of the starting position
+            actions = None: the actions of s, if already known
+
+        Returns:
+            A list with one value per name in Evaluator.names
+        """
+        n = len(s.ps)
+        if n == 1:
+            return [(n0 - n) / n0, 1, 1, 1, 0]
+        if actions is None:
+            actions = s.getActions()
+
+        neighbours = {p: [] for p in s.square}
+        for (p1, p2) in actions:
+            neighbours[p1].append(p2)
+            neighbours[p2].append(p1)
+
+        # the component of the king in the undirected capture graph
+        seen = {s.king}
+        stack = [s.king]
+        while len(stack) > 0:
+            for p in neighbours[stack.pop()]:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+
+        return [
+            (n0 - n) / n0,
+            (len(seen) - 1) / (n - 1),
+            min(sum(s.caps.values()) / (2 * n), 1),
+            min(sum(p1 is s.king for (p1, p2) in actions) / (n - 1), 1),
+            sum(len(ns) == 0 for ns in neighbours.values()) / n
+        ]
+
+    def value(self, s, n0, actions = None):
+        """Estimates the value of the rollout through a position
+
+        Args:
+            s: the state to evaluate, not a goal state
+            n0: the number of pieces of the starting position
+            actions = None: the actions of s, if already known
+
+        Returns:
+            A value in [0, 1), a won rollout being worth 1
+        """
+        f = self.features(s, n0, actions)
+        v = self.weights[0] + sum(w * x for w, x in zip(self.weights[1:], f))
+        return min(max(v, 0), 0.999)
+
+    def __call__(self, s, a, s2):
+        """Evaluates capture a from state s to state s2, so an Evaluator can be used as the evaluate function of Beam
+        """
+        return self.value(s2, len(s.ps))
+
+    @classmethod
+    def collect(cls, states, cutoff, h = "R", rng = None):
+        """Logs samples from rollouts, to fit weights with
+
+        From every starting state a rollout is played to the end, choosing by heuristic h or uniformly at random if h is None.
+        The position after cutoff captures is described by its features and labelled with the value of the finished rollout.
+
+        Args:
+            states: an iterable of starting states
+            cutoff: the number of captures after which the position is sampled
+            h = "R": the heuristic used in the rollouts
+            rng = None: a seed, random.Random or NumPy Generator for random rollouts, see Utils.makeRng
+
+        Returns:
+            A list of (features, value) tuples, rollouts ending before the cutoff are left out
+        """
+        rng = Utils.makeRng(rng)
+        e = cls()
+        samples = []
+        for s0 in states:
+            n0 = len(s0.ps)
+            s = s0
+            sample = None
+            depth = 0
+            while True:
+                actions = s.getLiveActions()
+                if depth == cutoff and len(actions) > 0:
+                    sample = e.features(s, n0, actions)
+                if len(actions) == 0:
+                    break
+                if h is not None:
+                    p1, p2 = max(actions, key=lambda a: s.heuristic(h, a[0], a[1]))
+                else:
+                    p1, p2 = rng.choice(actions)
+                s = s.nextState(p1, p2)
+                depth += 1
+            if sample is not None:
+                samples.append((sample, 1 if s.isGoal() else (n0 - len(s.ps)) / n0))
+        return samples
+
+    @classmethod
+    def fit(cls, samples, ridge = 1e-6):
+        """Fits the weights to samples by least squares
+
+        Solves the normal equations (X^T X + ridge I) w = X^T y, with a column of ones for the bias.
+
+        Args:
+            samples: a list of (features, value) tuples, see Evaluator.collect
+            ridge = 1e-6: regularisation keeping the equations solvable when a feature is constant
+
+        Returns:
+            An Evaluator with the fitted weights
+        """
+        m = len(cls.names) + 1
+        a = [[0.0] * m for _ in range(m)]
+        b = [0.0] * m
+        for f, y in samples:
+            x = [1.0] + list(f)
+            for i in range(m):
+                b[i] += x[i] * y
+                for j in range(m):
+                    a[i][j] += x[i] * x[j]
+        for i in range(m):
+            a[i][i] += ridge
+
+        # Gaussian elimination with partial pivoting
+        for i in range(m):
+            pivot = max(range(i, m), key=lambda r: abs(a[r][i]))
+            a[i], a[pivot] = a[pivot], a[i]
+            b[i], b[pivot] = b[pivot], b[i]
+            for r in range(i + 1, m):
+                factor = a[r][i] / a[i][i]
+                for j in range(i, m):
+                    a[r][j] -= factor * a[i][j]
+                b[r] -= factor * b[i]
+        w = [0.0] * m
+        for i in reversed(range(m)):
+            w[i] = (b[i] - sum(a[i][j] * w[j] for j in range(i + 1, m))) / a[i][i]
+
+        return cls(w)
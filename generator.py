@@ -1,12 +1,25 @@
 from pieces import Piece
 from utils import Square, Utils
 from state import State
-import random as rd
+from backtrack import Backtrack
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 
 class Generator():
     """Generates starting states based on certain preconditions
+
+    Attributes:
+        rng: the random number generator, see Utils.makeRng
     """
+    def __init__(self, rng = None):
+        """Initialises an instance of Generator
+
+        Args:
+            rng = None: a seed, random.Random or NumPy Generator, the global random module if None
+        """
+        self.rng = Utils.makeRng(rng)
+
     def getPuzzle(self, n):
         """Interface for other parts of code
         
@@ -15,7 +28,6 @@ class Generator():
         
         Args:
             n: the number of pieces
-            s: seed for random
         Returns:
             A starting state corresponding to a level n+1 puzzle of Solo Chess
         """
@@ -24,6 +36,109 @@ class Generator():
             if s0 is not None:
                 return s0
             
+    def getPuzzles(self, n, k, band, measure = "visited", workers = None, batch = None, limit = None):
+        """Generates puzzles whose difficulty lies inside a target band
+
+        Candidates are generated as usual and scored with self.difficulty, which runs a cheap reference solver.
+        Candidates outside the band are rejected. Scoring happens in a pool of worker processes,
+        one batch of candidates at a time, while the main process generates the next batch.
+
+        Args:
+            n: the number of pieces
+            k: the number of puzzles to return
+            band: a (low, high) tuple, the inclusive range of accepted difficulties
+            measure = "visited": the difficulty measure, see self.difficulty
+            workers = None: the number of worker processes, None or 1 scores candidates in this process
+            batch = None: the number of candidates scored per round, defaults to four per worker
+            limit = None: bound on the work spent scoring a candidate, see self.difficulty.
+                Defaults to the upper bound of the band for visited, which counts the same work, and to no bound for solutions.
+
+        Returns:
+            A list of k (state, difficulty) tuples
+        """
+        low, high = band
+        batch = batch or 4 * (workers or 1)
+        if limit is None and measure == "visited":
+            # solving further than the upper bound is wasted effort, the candidate is rejected anyway
+            limit = high
+        puzzles = []
+
+        executor = ProcessPoolExecutor(workers) if workers is not None and workers > 1 else None
+        try:
+            while len(puzzles) < k:
+                cands = [self.getPuzzle(n) for _ in range(batch)]
+
+                if executor is None:
+                    ds = map(Generator.difficulty, cands, repeat(measure), repeat(limit))
+                else:
+                    ds = executor.map(Generator.difficulty, [s0.toBytes() for s0 in cands], repeat(measure), repeat(limit))
+
+                for s0, d in zip(cands, ds):
+                    if d is not None and low <= d <= high and len(puzzles) < k:
+                        puzzles.append((s0, d))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        return puzzles
+
+    @classmethod
+    def difficulty(cls, s0, measure = "visited", limit = None):
+        """Measures the difficulty of a puzzle
+
+        Two measures are supported:
+            visited: the number of nodes visited by Backtrack with the Rank heuristic, higher is harder
+            solutions: the number of distinct winning capture sequences, lower is harder
+
+        Args:
+            s0: the starting state of the puzzle, or its State.toBytes encoding
+            measure = "visited": which of the measures above to use
+            limit = None: bound on the work spent. For visited this is the node limit of the solver,
+                for solutions the number of states that may be expanded.
+
+        Returns:
+            The difficulty, or None if the limit was exceeded before the measure was known
+        """
+        if isinstance(s0, bytes):
+            s0 = State.fromBytes(s0)
+
+        match measure:
+            case "visited":
+                bt = Backtrack(s0, h = "R", limit = limit)
+                bt.run()
+                return None if bt.exceeded() else bt.visited
+            case "solutions":
+                memo = dict()
+                n = cls.countSolutions(s0, memo, limit)
+                return None if limit is not None and len(memo) > limit else n
+
+    @classmethod
+    def countSolutions(cls, s, memo, limit = None):
+        """Counts the winning capture sequences from a state
+
+        Transpositions are memoized, so every distinct state is expanded only once.
+
+        Args:
+            s: the state to count from
+            memo: dictionary from state to its count, filled by this method
+            limit = None: stop expanding once memo holds more than this many states
+
+        Returns:
+            The number of capture sequences leading from s to a goal state
+        """
+        if s in memo:
+            return memo[s]
+        if limit is not None and len(memo) > limit:
+            return 0
+
+        if s.isGoal():
+            n = 1
+        else:
+            n = sum(cls.countSolutions(s2, memo, limit) for s2 in s.transition().values())
+
+        memo[s] = n
+        return n
+
     def generate(self, n):
         """Performs the actual generation of a starting state
         
@@ -44,30 +159,32 @@ class Generator():
 
         # Adding the king
         k = Piece("K")
-        s = Square(rd.choice([i for i in range(8)]), rd.choice([i for i in range(8)]))
+        s = Square(self.rng.choice([i for i in range(8)]), self.rng.choice([i for i in range(8)]))
 
         ps.add(k)
         qs.add(s)
         caps[k] = 2
         square[k] = s
+
+        # bitmask of qs for the expansion tables
+        occ = 1 << Utils.toIndex(s)
         
         for i in range(n-1):
-            # starting with pieces with captures left
-            pte = [p for p in ps if caps[p] > 0]
-            
-            # checking per piece whether expansion possible
-            pte = {p: sqrs for p in pte if len(sqrs := self.getExpansions(p, square, qs)) > 0}
+            # checking per piece with captures left whether expansion possible
+            # in order of creation, the order of ps depends on memory addresses
+            pte = {p: m for p in square if caps[p] > 0 and (m := self.getExpansionMask(p, square[p], occ))}
             
             # got stuck
             if len(pte) == 0: return None
 
 
             # choose a random piece from this list and a random reachable square
-            p = rd.choice(list(pte.keys()))
-            s = rd.choice(pte[p])
+            p = self.rng.choice(list(pte.keys()))
+            s = Utils.fromIndex(self.rng.choice(list(Utils.bits(pte[p]))))
 
             # perform expansion with p, s
             self.expand(p, s, ps, qs, caps, square)
+            occ |= 1 << Utils.toIndex(s)
 
         s0 = State(square)
         return s0
@@ -87,7 +204,7 @@ class Generator():
             square: dictionary from piece to square
         """
         # make a new piece and place it on p's square
-        p2 = Piece(rd.choice(["Q", "R", "B", "N", "P"]))
+        p2 = Piece(self.rng.choice(["Q", "R", "B", "N", "P"]))
         caps[p2] = 2
         square[p2] = square[p]
         ps.add(p2)
@@ -100,7 +217,7 @@ class Generator():
     def getExpansions(self, p: Piece, square, qs):
         """Gets the sqaure a piece can expand to
         
-        Uses the Utils.possMovements method. Made it a seperate method here for clarity.
+        Convenience wrapper around self.getExpansionMask for when the squares themselves are needed.
         
         Args:
             p: piece for which to check squares it can expand to.
@@ -110,5 +227,20 @@ class Generator():
         Returns:
             list of squares piece p could move to its original square from
         """
-        sqrs = Utils.possMovements(p, square[p], qs)
-        return sqrs
\ No newline at end of file
+        m = self.getExpansionMask(p, square[p], Utils.toMask(qs))
+        return [Utils.fromIndex(i) for i in Utils.bits(m)]
+
+    def getExpansionMask(self, p: Piece, q, occ):
+        """Gets the squares a piece can expand to as a bitmask
+
+        Uses the precomputed ray and step tables of Utils, so no squares are materialized.
+
+        Args:
+            p: piece for which to check squares it can expand to.
+            q: the square p occupies
+            occ: bitmask of occupied squares
+
+        Returns:
+            bitmask of the squares piece p could move to its original square from
+        """
+        return Utils.expansions(p.type, Utils.toIndex(q), occ)
@@ -1,7 +1,14 @@
 from math import sqrt, log
 from state import State
-import random as rd
+from utils import Utils
+from corpus import Corpus
+from evaluate import Evaluator
+from collections import Counter, OrderedDict
 import math
+import json
+import os
+import struct
+import time
 
 class Node():
     """A class which represents a node in a game tree
@@ -30,6 +37,15 @@ class Node():
         self.wins = 0
         self.visits = 0
         self.leaf = True
+        # with progressive widening: the actions not yet turned into children, best last
+        self.pending = None
+        # heuristic value of prevAction, used as progressive bias
+        self.prior = 0
+        # Utils.actionKey of prevAction, filled when needed by RAVE
+        self.key = None
+        # for single-player MCTS: the best value and the sum of squared values backpropagated through this node
+        self.best = 0
+        self.squares = 0
 
     def getNexts(self):
         """Method to fill the self.nexts list
@@ -60,13 +76,185 @@ class Node():
     def isTerminal(self):
         return self.s.isTerminal()
 
+    def getRoute(self):
+        """Retrieves the route from the root of the tree to this node
+        
+        Uses the parent attribute to walk up to the root.
+
+        Returns:
+            A list containing the nodes on route from the root to this node
+        """
+        node = self
+        route = [node]
+        while node.parent is not None:
+            node = node.parent
+            route.append(node)
+        
+        route.reverse()
+        return route
+
+class Stats():
+    """Counters and timers of a single MCTS run
+
+    Collected when MCTS is created with stats = True. Phase timing wraps the phase methods once at the start of MCTS.run,
+    so a run without statistics executes exactly the same code as before.
+
+    Attributes:
+        phases: per phase (select, grow, simulate, backprop) the number of calls, the time spent in seconds and the nodes visited
+        rollouts: histogram of rollout lengths, i.e. the number of actions taken per simulation
+        depths: histogram of the depths of the nodes reached by selection
+        expansions: the number of nodes expanded
+        children: the number of children generated by expansions, before removing transpositions
+        hits: the number of generated children removed because their state already was in the tree
+        rolloutNodes: the number of nodes created during simulation, which are all discarded afterwards
+    """
+    def __init__(self):
+        self.phases = {phase: [0, 0.0, 0] for phase in ["select", "grow", "simulate", "backprop"]}
+        self.rollouts = Counter()
+        self.depths = Counter()
+        self.expansions = 0
+        self.children = 0
+        self.hits = 0
+        self.rolloutNodes = 0
+
+    def instrument(self, mcts, phases):
+        """Wraps the phase methods of an MCTS object with counters and timers
+
+        Args:
+            mcts: the MCTS object the phases belong to
+            phases: the bound select, grow, simulate and backprop methods, in that order
+
+        Returns:
+            The wrapped methods, in the same order
+        """
+        def timed(name, f):
+            counters = self.phases[name]
+            def wrapper(*args):
+                before = mcts.visited
+                start = time.perf_counter()
+                r = f(*args)
+                counters[1] += time.perf_counter() - start
+                counters[0] += 1
+                counters[2] += mcts.visited - before
+                if name == "select":
+                    self.depths[mcts.visited - before - 1] += 1
+                elif name == "simulate":
+                    self.rollouts[mcts.visited - before] += 1
+                return r
+            return wrapper
+
+        return [timed(name, f) for name, f in zip(self.phases, phases)]
+
+    def expanded(self, children, hits):
+        """Records an expansion which generated children, of which hits were transpositions
+        """
+        self.expansions += 1
+        self.children += children
+        self.hits += hits
+
+    def rolled(self, children):
+        """Records a simulation step which generated children
+        """
+        self.rolloutNodes += children
+
+    def asDict(self) -> dict:
+        """Returns the statistics as a dictionary of plain values
+
+        Besides the attributes, this includes the transposition hit rate, the mean branching factor of expansions
+        and the maximum depth reached.
+        """
+        return {
+            "phases": {name: {"calls": c[0], "time": c[1], "visited": c[2]} for name, c in self.phases.items()},
+            "rollouts": dict(sorted(self.rollouts.items())),
+            "depths": dict(sorted(self.depths.items())),
+            "max_depth": max(self.depths, default=0),
+            "expansions": self.expansions,
+            "branching": self.children / self.expansions if self.expansions > 0 else 0,
+            "hit_rate": self.hits / self.children if self.children > 0 else 0,
+            "created": {"expansion": self.children, "simulation": self.rolloutNodes},
+            "discarded": {"transposition": self.hits, "simulation": self.rolloutNodes}
+        }
+
+    def toJson(self) -> str:
+        return json.dumps(self.asDict())
+
+class RolloutCache():
+    """A size-capped cache of the outcomes of deterministic rollouts
+
+    A heuristic rollout from a state always ends in the same terminal state, and so does the rollout from every state along the way.
+    The outcome stored is the number of pieces left in that terminal state, which does not depend on the root of the search,
+    so one cache can be shared by searches on different puzzles. The least recently used entries are evicted first.
+
+    Attributes:
+        size: the maximum number of states remembered
+        outcomes: ordered dictionary from state to the number of pieces left at the end of its rollout
+        hits: the number of successful lookups
+        misses: the number of failed lookups
+    """
+    def __init__(self, size = 100000):
+        self.size = size
+        self.outcomes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, s):
+        """Looks up the outcome of the rollout from state s
+
+        Returns:
+            The number of pieces left, or None if unknown
+        """
+        left = self.outcomes.get(s)
+        if left is None:
+            self.misses += 1
+            return None
+        self.outcomes.move_to_end(s)
+        self.hits += 1
+        return left
+
+    def put(self, states, left):
+        """Stores the outcome shared by the states on one rollout
+
+        Args:
+            states: the states on the rollout
+            left: the number of pieces left at its end
+        """
+        for s in states:
+            self.outcomes[s] = left
+            self.outcomes.move_to_end(s)
+        while len(self.outcomes) > self.size:
+            self.outcomes.popitem(last=False)
+
+    def __len__(self):
+        return len(self.outcomes)
+
 class MCTS():
     """A class which represents a MCTS algorithm
     
     The class contains the logic for traversing the tree and simulating rollouts. The tree structure is
     implicitly embedded in the Node objects
+
+    A search can be checkpointed to a file with self.save and continued from it with MCTS.resume.
+    Layout of a checkpoint file, all integers little-endian:
+        header: magic, version, length of the parameters, node count, AMAF entry count, visited (see MCTS.header)
+        parameters: h, c, d, pw, pb, rave, cutoff and sp as JSON
+        root: the starting state as a corpus record, see Corpus.pack
+        nodes: in preorder, every node as MCTS.record followed by its pending actions, 0xffff pending for None
+        amaf: every entry as MCTS.amafRecord
+        random: the state of the random number generator, see MCTS.randomState
+    Actions are stored as the squares of the two pieces (8*y + x) and turned back into pieces of the parent's state when loading.
     """
-    def __init__(self, s0, h = None, c = 2, d = 3):
+
+    magic = b"MCTC"
+    version = 2
+    header = struct.Struct("<4sHHIIQ")
+    # from square, to square, wins, visits, prior, leaf, best, sum of squares, number of children, number of pending actions
+    record = struct.Struct("<BBdIdBddHH")
+    # from square, to square, type, wins, visits
+    amafRecord = struct.Struct("<BBBdI")
+    # Mersenne Twister words and position, then whether a gauss value is kept and the value
+    randomState = struct.Struct("<625IBd")
+
+    def __init__(self, s0, h = None, c = 2, d = 3, stats = False, memo = None, pw = None, pb = 0, rave = None, checkpoint = None, interval = 600, rng = None, cutoff = None, evaluator = None, sp = None):
         """Initialises an instance of MCTS
         
         Args:
@@ -74,7 +262,29 @@ class MCTS():
             vals: a dictionary keeping track of values of nodes/states
             ns: a dictionary keeping track of the number of times a node has been visited
             h: whether to implement heuristics
+            stats = False: whether to collect per-phase statistics in self.stats, see Stats
+            memo = None: the maximum number of rollout outcomes to remember, or a RolloutCache to share between searches.
+                Only used with heuristics, when rollouts are deterministic. With heuristics it cannot be combined with rave,
+                as a hit ends the playout before RAVE has seen the rest of its actions.
+            pw = None: a (k, alpha) tuple enabling progressive widening, a node visited n times gets ceil(k * n^alpha) children.
+                Children are added in order of heuristic value, using the Rank heuristic if h is None.
+            pb = 0: weight of the progressive bias term pb * prior / (visits + 1) in self.uct, where prior is the heuristic value of the node's action
+            rave = None: the equivalence parameter k of RAVE, enabling it. The all-moves-as-first value of a node's action is blended into its
+                exploitation term with weight sqrt(k / (3 * visits + k))
+            checkpoint = None: path of a file self.run saves the search to every interval seconds, see self.save
+            interval = 600: seconds between checkpoints
+            rng = None: a seed, random.Random or NumPy Generator used for all random choices, the global random module if None
+            cutoff = None: the number of captures after which a rollout stops and returns the static evaluation of its position
+                Rollouts cut short cannot win, so solutions are then only found by the tree itself.
+            evaluator = None: the Evaluator used with cutoff, one with the default weights if None. It is not stored in checkpoints.
+            sp = None: the constant D of single-player MCTS, enabling it. The exploitation term becomes the best value found below a node
+                instead of the mean, and a variance term sqrt((sum of squared values - visits * mean^2 + D) / visits) is added, see self.uct
+
+        Raises:
+            ValueError: if memo and rave are both given with heuristics, or checkpoint is given for a search that cannot be saved, see self.checkSavable
         """
+        if memo is not None and rave is not None and h is not None:
+            raise ValueError("rave needs every action of a playout, which a rollout cache cuts short")
         self.c = c
         self.root = Node(s0, None, None)
         self.h = h
@@ -82,54 +292,283 @@ class MCTS():
 
         self.tree = {self.root.s}        
         self.visited = 0
+        # the goal node, once found
+        self.goal = None
+        self.stats = Stats() if stats else None
+        self.memo = RolloutCache(memo) if isinstance(memo, int) else memo
+        self.pw = pw
+        self.pb = pb
+        self.rave = rave
+        # all-moves-as-first statistics: Utils.actionKey to [wins, visits]
+        self.amaf = dict()
+        # keys of the actions taken in the current simulation
+        self.playout = []
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.rng = Utils.makeRng(rng)
+        self.cutoff = cutoff
+        self.evaluator = evaluator if evaluator is not None or cutoff is None else Evaluator()
+        self.sp = sp
+        # the phase methods run by self.step, instrumented with stats, and whether the search has ended
+        self.phases = None
+        self.done = False
+        if checkpoint is not None:
+            # fail now instead of at the first save, an interval into the search
+            self.checkSavable()
 
     def run(self):
         """Starts the mcts algorithm on the initial state
         
-        This is the main loop of the mcts algorithm. The selection phase is fully contained here.
-        When a leaf node is found, this method calls a function to expand and simulate a node.
+        This is the main loop of the mcts algorithm. Every iteration selects a leaf node, expands and simulates it.
         After that, it calls a method for performing backpropogation.
         If a solution is found, this method calls a method to retrieve the route (sequence of actions) from the tree and returns, stopping the loop
+
+        Returns:
+            The route from the root to the goal node found, as returned by self.getroute
         """
+        due = time.monotonic() + self.interval
+
         while True:
-            self.visited += 1
-            cur = self.root
-            while len(cur.nexts) > 0:
-                if rd.randint(0,100) <= self.d:
-                    # select random child
-                    child = rd.choice(cur.nexts)
-                else:
-                    # select child with highest uct metric
-                    ucts = {node: self.uct(node) for node in cur.nexts}
-                    child = max(ucts, key=ucts.get)
-
-                cur = child
-                self.visited += 1
+            route = self.step(1)
+            if route is not None:
+                return route
+
+            if self.checkpoint is not None and time.monotonic() >= due:
+                self.save(self.checkpoint)
+                due = time.monotonic() + self.interval
+
+    def step(self, k):
+        """Runs at most k iterations of the search, so it can be interleaved with other searches
+
+        Args:
+            k: the number of iterations
+
+        Returns:
+            The route from the root to the goal node once found, as returned by self.getroute, otherwise None
+        """
+        if self.phases is None:
+            phases = [self.select, self.grow, self.simulate, self.backprop]
+            if self.stats is not None:
+                phases = self.stats.instrument(self, phases)
+            self.phases = phases
+        select, grow, simulate, backprop = self.phases
+
+        for _ in range(k):
+            cur = select()
+            cur = grow(cur)
+            if self.goal is not None:
+                # a goal child was created while expanding or widening
+                self.done = True
+                return self.getroute(self.goal)
 
-            if cur.visits > 0:
-                # has been simulated, expand node
-                self.expand(cur)
-                if len(cur.nexts) > 0:
-                    cur.leaf = False
-                    
-                    # not a losing/terminal state
-
-                    if rd.randint(0,100) <= self.d:
-                        # select random child
-                        child = rd.choice(cur.nexts)
-                    else:
-                        # select child with highest uct metric
-                        ucts = {node: self.uct(node) for node in cur.nexts}
-                        child = max(ucts, key=ucts.get)
-                    cur = child
-                    self.visited += 1
-                
             # simulate that child
-            v = self.simulate(cur)
+            v = simulate(cur)
             if v == 1:
-                return
+                self.done = True
+                return self.getroute(self.goal)
+            else:
+                backprop(cur, v)
+        return None
+
+    def checkSavable(self):
+        """Checks that the search can be written to a checkpoint file by self.save
+
+        Raises:
+            ValueError: if the starting state has pieces off the 8x8 board, or the random number generator is not
+                the random module or a random.Random
+        """
+        for q in self.root.s.qs:
+            if not (0 <= q.x <= 7 and 0 <= q.y <= 7):
+                raise ValueError(f"square {q} is not on the board")
+        if not isinstance(self.rng.getstate(), tuple):
+            raise ValueError("only searches using the random module or random.Random can be checkpointed")
+
+    def save(self, fn):
+        """Writes the search to a checkpoint file
+
+        The tree statistics, the pending actions of progressive widening, the AMAF statistics, the visited counter
+        and the state of the random number generator are stored, see the class documentation for the layout.
+        The transposition set is not stored as it consists of the states of the nodes.
+        The file is replaced atomically, so an interrupted save leaves the previous checkpoint intact.
+
+        Args:
+            fn: the path of the checkpoint file
+
+        Raises:
+            ValueError: if the starting state has pieces off the 8x8 board, or the random number generator is not
+                the random module or a random.Random, see self.checkSavable
+        """
+        self.checkSavable()
+
+        def index(q):
+            if not (0 <= q.x <= 7 and 0 <= q.y <= 7):
+                raise ValueError(f"square {q} is not on the board")
+            return Utils.toIndex(q)
+
+        params = json.dumps({"h": self.h, "c": self.c, "d": self.d, "pw": self.pw, "pb": self.pb, "rave": self.rave, "cutoff": self.cutoff, "sp": self.sp}).encode()
+        chunks = [b"", params, Corpus.pack(self.root.s)]
+
+        count = 0
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            count += 1
+            if node.parent is None:
+                q1 = q2 = 0
             else:
-                self.backprop(cur, v)
+                q1, q2 = index(node.parent.s.square[node.prevAction[0]]), index(node.parent.s.square[node.prevAction[1]])
+            pending = node.pending if node.pending is not None else []
+            chunks.append(MCTS.record.pack(q1, q2, node.wins, node.visits, node.prior, node.leaf, node.best, node.squares, len(node.nexts),
+                                           len(pending) if node.pending is not None else 0xffff))
+            chunks.append(bytes(index(node.s.square[p]) for a in pending for p in a))
+            # first child on top
+            stack.extend(reversed(node.nexts))
+
+        for (q1, q2, t), (wins, visits) in self.amaf.items():
+            chunks.append(MCTS.amafRecord.pack(index(q1), index(q2), t, wins, visits))
+
+        _, words, gauss = self.rng.getstate()
+        chunks.append(MCTS.randomState.pack(*words, gauss is not None, gauss or 0))
+
+        chunks[0] = MCTS.header.pack(MCTS.magic, MCTS.version, len(params), count, len(self.amaf), self.visited)
+        tmp = fn + ".tmp"
+        with open(tmp, "wb") as file:
+            file.write(b"".join(chunks))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, fn)
+
+    @classmethod
+    def resume(cls, fn, **params):
+        """Restores a search from a checkpoint file written by self.save
+
+        The random number generator is restored as well, so calling run() on the result continues the search where it was saved.
+        That is the global random module unless an rng is given.
+        Checkpoints keep being written to fn unless another checkpoint path is given.
+
+        Args:
+            fn: the path of the checkpoint file
+            **params: keyword arguments of MCTS, overriding the parameters stored in the checkpoint
+
+        Returns:
+            An MCTS object
+        """
+        with open(fn, "rb") as file:
+            buf = file.read()
+
+        magic, version, size, count, entries, visited = cls.header.unpack_from(buf, 0)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError(f"{fn} is not a version {cls.version} MCTS checkpoint")
+        pos = cls.header.size
+
+        stored = json.loads(buf[pos:pos + size])
+        pos += size
+        if stored["pw"] is not None:
+            stored["pw"] = tuple(stored["pw"])
+        stored.setdefault("checkpoint", fn)
+        stored.update(params)
+
+        mcts = cls(Corpus.unpack(buf, pos), **stored)
+        pos += Corpus.recordSize
+
+        # nodes whose children are still being read, with the number of children left
+        stack = []
+        for _ in range(count):
+            q1, q2, wins, visits, prior, leaf, best, squares, children, pending = cls.record.unpack_from(buf, pos)
+            pos += cls.record.size
+            if len(stack) == 0:
+                node = mcts.root
+            else:
+                parent = stack[-1][0]
+                s = parent.s
+                a = (s.topiece[Utils.fromIndex(q1)], s.topiece[Utils.fromIndex(q2)])
+                node = Node(s.nextState(a[0], a[1]), parent, a)
+                parent.nexts.append(node)
+                mcts.tree.add(node.s)
+                stack[-1][1] -= 1
+            node.wins = wins
+            node.visits = visits
+            node.prior = prior
+            node.leaf = bool(leaf)
+            node.best = best
+            node.squares = squares
+
+            if pending != 0xffff:
+                topiece = node.s.topiece
+                squares = buf[pos:pos + 2 * pending]
+                node.pending = [(topiece[Utils.fromIndex(squares[i])], topiece[Utils.fromIndex(squares[i + 1])]) for i in range(0, len(squares), 2)]
+                pos += 2 * pending
+
+            if children > 0:
+                stack.append([node, children])
+            while len(stack) > 0 and stack[-1][1] == 0:
+                stack.pop()
+
+        for _ in range(entries):
+            q1, q2, t, wins, n = cls.amafRecord.unpack_from(buf, pos)
+            pos += cls.amafRecord.size
+            mcts.amaf[(Utils.fromIndex(q1), Utils.fromIndex(q2), t)] = [wins, n]
+
+        state = cls.randomState.unpack_from(buf, pos)
+        mcts.rng.setstate((3, tuple(state[:625]), state[626] if state[625] else None))
+        mcts.visited = visited
+        return mcts
+
+    def select(self):
+        """Performs the selection phase of mcts
+
+        Descends from the root by self.choose until a node without children is found.
+
+        Returns:
+            The node selected
+        """
+        self.visited += 1
+        cur = self.root
+        while len(cur.nexts) > 0:
+            if self.pw is not None:
+                self.widen(cur)
+            cur = self.choose(cur)
+            self.visited += 1
+        return cur
+
+    def grow(self, cur: Node):
+        """Expands a selected node if it has been simulated before
+
+        Args:
+            cur: the node returned by self.select
+
+        Returns:
+            A newly created child of cur chosen by self.choose, or cur itself if it was not expanded or has no children
+        """
+        if cur.visits > 0:
+            # has been simulated, expand node
+            self.expand(cur)
+            if len(cur.nexts) > 0:
+                cur.leaf = False
+                
+                # not a losing/terminal state
+                cur = self.choose(cur)
+                self.visited += 1
+        return cur
+
+    def choose(self, node: Node):
+        """Chooses a child of a node during selection
+
+        With a chance of self.d percent a random child is chosen, otherwise the child with the highest uct value.
+
+        Args:
+            node: the node to choose a child of, has to have children
+
+        Returns:
+            The child chosen
+        """
+        if self.rng.randint(0,100) <= self.d:
+            # select random child
+            return self.rng.choice(node.nexts)
+        else:
+            # select child with highest uct metric
+            ucts = {n: self.uct(n) for n in node.nexts}
+            return max(ucts, key=ucts.get)
 
     def getroute(self, node: Node):
         """Retrieves the route from the root to a node
@@ -143,31 +582,44 @@ class MCTS():
         Returns:
             A list containing the nodes on route from the root to the supplied node
         """
-        route = [node]
-        while node.parent is not None:
-            node = node.parent
-            route.append(node)
-        
-        route.reverse()
-        return route
+        return node.getRoute()
 
     def simulate(self, node: Node):
         """Performs the simulation phase of the mcts algorithm
         
         This method performs the simulation phase starting from the supplied node. It uses the heuristics by Verlaan to determine which actions to take.
-        When a terminal state is found, the value is retrieved and is returned.
+        When a terminal state is found, the value is retrieved and is returned. A winning terminal node is stored in self.goal.
+        With self.cutoff, a rollout reaching that many captures returns the static evaluation of its position instead, see Evaluator.
 
         Args:
             node: the node from which to perform simulation.
         Returns:
             the value of the terminal state.
         """
-        node.getNexts()
+        # heuristic rollouts are deterministic, so their outcome can be looked up
+        memo = self.memo if self.h is not None else None
+        left = None
+        path = []
+        if memo is not None:
+            left = memo.get(node.s)
+            path.append(node.s)
+
         cur = node
+        depth = 0
+        if left is None:
+            node.getNexts()
 
         # Keep choosing a new action as long as current state is not terminal
         while(len(cur.nexts)!=0):
+            if self.cutoff is not None and depth >= self.cutoff:
+                # estimated, so neither a win nor worth remembering
+                v = self.evaluator.value(cur.s, len(self.root.s.ps), [next.prevAction for next in cur.nexts])
+                cur.clearNexts()
+                return v
+            depth += 1
             self.visited += 1
+            if self.stats is not None:
+                self.stats.rolled(len(cur.nexts))
 
             if self.h is not None:
                 # use heuristics
@@ -175,7 +627,10 @@ class MCTS():
                 next = max(hvals, key=hvals.get)
             else:
                 # uniform random
-                next = rd.choice(cur.nexts)
+                next = self.rng.choice(cur.nexts)
+
+            if self.rave is not None:
+                self.playout.append(Utils.actionKey(cur.s, next.prevAction[0], next.prevAction[1]))
             
             # self.prune(cur)
             # cur = next
@@ -183,10 +638,26 @@ class MCTS():
 
             cur.clearNexts()
             cur = next
+            if memo is not None:
+                left = memo.get(cur.s)
+                if left is not None:
+                    break
+                path.append(cur.s)
             cur.getNexts()
         
+        if left is not None:
+            # the rest of this rollout was played before, every state on it so far has the same outcome
+            memo.put(path, left)
+            cur.clearNexts()
+            return (len(self.root.s.ps) - left)/len(self.root.s.ps)
+
         # terminal node, get value win ratio or just 1
         v = (len(self.root.s.ps) - len(cur.s.ps))/len(self.root.s.ps) if not cur.s.isGoal() else 1
+        if v == 1:
+            self.goal = cur
+        elif memo is not None:
+            # winning rollouts end the search, so only losing outcomes are stored
+            memo.put(path, len(cur.s.ps))
         # self.prune(cur)
         cur.clearNexts()
         return v
@@ -194,35 +665,108 @@ class MCTS():
     def backprop(self, node: Node, v):
         """Performs the backpropagation phase of mcts
         
-        Moves up through the tree from the supplied node to the root, updating the wins and visits stats.
+        Moves up through the tree from the supplied node to the root, updating the wins and visits stats,
+        and with single-player MCTS the best value and the sum of squared values.
+        With RAVE, every action taken on the way from the root through the simulation is credited once in self.amaf as well.
         
         Args:
             node: the node from which to start backpropagating
             v: the value of node
         """
         cur = node
-        cur.wins += v
-        cur.visits += 1
-        self.visited += 1
-        while cur.parent is not None:
-            cur = cur.parent
+        while cur is not None:
             cur.wins += v
             cur.visits += 1
+            if self.sp is not None:
+                cur.best = max(cur.best, v)
+                cur.squares += v * v
             self.visited += 1
+            cur = cur.parent
+
+        if self.rave is not None:
+            keys = set(self.playout)
+            cur = node
+            while cur.parent is not None:
+                keys.add(self.actionKey(cur))
+                cur = cur.parent
+            for key in keys:
+                stat = self.amaf.setdefault(key, [0, 0])
+                stat[0] += v
+                stat[1] += 1
+            self.playout = []
+
+    def actionKey(self, node: Node):
+        """Returns the Utils.actionKey of the action leading to a node, caching it in the node
+        """
+        if node.key is None:
+            node.key = Utils.actionKey(node.parent.s, node.prevAction[0], node.prevAction[1])
+        return node.key
 
     def expand(self, node: Node):
         """Performs the expansion phase of mcts
         
         Expands a node by calling the getNexts() method of the Node object.
+        With progressive widening, only the first children are created by self.widen instead.
         
         Args:
             node: the node to expand
             """
+        if self.pw is not None:
+            self.widen(node)
+            return
+
         node.getNexts()
-        node.nexts = [n for n in node.nexts if n.s not in self.tree]
-        
+        children = len(node.nexts)
+        nexts = []
         for n in node.nexts:
+            # two captures of the node can lead to the same state as well
+            if n.s in self.tree:
+                continue
             self.tree.add(n.s)
+            nexts.append(n)
+            if len(n.s.ps) == 1 and n.s.isGoal():
+                self.goal = n
+        node.nexts = nexts
+
+        if self.stats is not None:
+            self.stats.expanded(children, children - len(node.nexts))
+
+    def widen(self, node: Node):
+        """Adds children to a node as allowed by progressive widening
+
+        On the first call the actions of the node are ordered by heuristic value. Each call then creates children from the best remaining actions
+        until the node has ceil(k * visits^alpha) children, skipping children whose state is already in the tree.
+
+        Args:
+            node: the node to widen
+        """
+        s = node.s
+        h = self.h or "R"
+        if node.pending is None:
+            actions = s.getLiveActions()
+            # best action last, so ties keep the order of getActions when popped
+            node.pending = sorted(actions, key=lambda a: s.heuristic(h, a[0], a[1]), reverse=True)
+            node.pending.reverse()
+
+        k, alpha = self.pw
+        allowed = math.ceil(k * max(node.visits, 1) ** alpha)
+        children = 0
+        hits = 0
+        while len(node.nexts) < allowed and len(node.pending) > 0:
+            p1, p2 = node.pending.pop()
+            child = Node(s.nextState(p1, p2), node, (p1, p2))
+            children += 1
+            if child.s in self.tree:
+                hits += 1
+                continue
+            self.tree.add(child.s)
+            child.prior = s.heuristic(h, p1, p2)
+            node.nexts.append(child)
+            if len(child.s.ps) == 1 and child.s.isGoal():
+                self.goal = child
+
+        if self.stats is not None and children > 0:
+            self.stats.expanded(children, hits)
 
     def prune(self, node: Node):
         for n in node.nexts:
@@ -236,12 +780,27 @@ class MCTS():
             node: the node for which to calculate the UCT value
             
         Returns:
-            The UCT value of node, according to the original UCT formula as designed by Kocsis et al
+            The UCT value of node, according to the original UCT formula as designed by Kocsis et al,
+            with the exploitation term blended with the RAVE value if self.rave is set
+            and plus the progressive bias term if self.pb is set.
+            With self.sp, the SP-MCTS formula of Schadd et al. with the best value as exploitation term
             """
         if node.visits == 0:
             return math.inf
         else:
             exploitation = node.wins / node.visits
             exploration = sqrt(log(node.parent.visits)/node.visits)
-            return exploitation + self.c * exploration
+            deviation = 0
+            if self.sp is not None:
+                # possible deviation, large for nodes with a few good results
+                deviation = sqrt(max(node.squares - node.visits * exploitation ** 2 + self.sp, 0) / node.visits)
+                exploitation = node.best
+            if self.rave is not None:
+                stat = self.amaf.get(self.actionKey(node))
+                if stat is not None:
+                    beta = sqrt(self.rave / (3 * node.visits + self.rave))
+                    exploitation = (1 - beta) * exploitation + beta * stat[0] / stat[1]
+            if self.pb:
+                return exploitation + self.c * exploration + deviation + self.pb * node.prior / (node.visits + 1)
+            return exploitation + self.c * exploration + deviation
     
@@ -0,0 +1,247 @@
+from mcts import Node
+from utils import Utils
+import math
+
+class NMCS():
+    """Nested Monte Carlo Search, as designed by Cazenave
+
+    A search of level 0 is a single rollout. A search of level l tries every action of the current state,
+    evaluates each of them with a search of level l - 1, and plays the first action of the best sequence found so far,
+    until the state is terminal. The score of a sequence is the number of captures in it, so a sequence of n - 1 captures solves the puzzle.
+
+    Attributes:
+        root: the node of the starting state
+        visited: the number of states for which actions were generated
+        tree: the set of states on which the searches of level 1 and up were run
+        goal: the goal node, once found
+    """
+    def __init__(self, s0, level = 2, h = None, rng = None):
+        """Initialises an instance of NMCS
+
+        Args:
+            s0: the starting state
+            level = 2: the nesting level of the top search
+            h = None: heuristic used in the rollouts, uniform random if None
+            rng = None: a seed, random.Random or NumPy Generator for the rollouts, the global random module if None
+        """
+        self.root = Node(s0, None, None)
+        self.level = level
+        self.h = h
+        self.rng = Utils.makeRng(rng)
+
+        self.visited = 0
+        self.tree = {s0}
+        self.goal = None
+        # number of captures that solves the puzzle
+        self.target = len(s0.ps) - 1
+
+    def run(self):
+        """Runs the top search
+
+        Returns:
+            The list of nodes from the root to the goal node, or None if the best sequence found does not solve the puzzle
+        """
+        score, seq = self.nested(self.root.s, self.level)
+        if score < self.target:
+            return None
+        self.goal = Sequence.toRoute(self.root, seq)[-1]
+        return self.goal.getRoute()
+
+    def nested(self, s, level):
+        """Performs a search of a given level from a state
+
+        Args:
+            s: the state to search from
+            level: the nesting level, 0 is a rollout
+
+        Returns:
+            A (score, sequence) tuple, sequence being the list of actions from s
+        """
+        if level == 0:
+            return self.rollout(s)
+
+        self.tree.add(s)
+        played = []
+        best = (-1, [])
+        # captures made before s, counting towards the target
+        depth = self.target - (len(s.ps) - 1)
+
+        while True:
+            actions = s.getLiveActions()
+            self.visited += 1
+            if len(actions) == 0:
+                break
+
+            for (p1, p2) in actions:
+                score, seq = self.nested(s.nextState(p1, p2), level - 1)
+                score += len(played) + 1
+                if score > best[0]:
+                    best = (score, played + [(p1, p2)] + seq)
+                if depth + score == self.target:
+                    # solved, no need to look further
+                    return best
+
+            # play the first action of the best sequence
+            p1, p2 = best[1][len(played)]
+            played.append((p1, p2))
+            s = s.nextState(p1, p2)
+            self.tree.add(s)
+
+        # the actions played follow the best sequence up to its end
+        return len(played), played
+
+    def rollout(self, s):
+        """Plays random or heuristic actions from a state until it is terminal
+
+        Args:
+            s: the state to start from
+
+        Returns:
+            A (score, sequence) tuple
+        """
+        seq = []
+        while True:
+            actions = s.getLiveActions()
+            self.visited += 1
+            if len(actions) == 0:
+                return len(seq), seq
+
+            if self.h is not None:
+                a = max(actions, key=lambda a: s.heuristic(self.h, a[0], a[1]))
+            else:
+                a = self.rng.choice(actions)
+            seq.append(a)
+            s = s.nextState(a[0], a[1])
+
+class NRPA():
+    """Nested Rollout Policy Adaptation, as designed by Rosin
+
+    Rollouts choose actions with probabilities proportional to exp(policy[action]), the policy being a dictionary over Utils.actionKey.
+    A search of level l runs a number of searches of level l - 1, each starting with the current policy,
+    and after each one moves the policy towards the best sequence found so far.
+
+    Attributes:
+        root: the node of the starting state
+        visited: the number of states for which actions were generated
+        tree: the set of states on the best sequences found
+        goal: the goal node, once found
+    """
+    def __init__(self, s0, level = 2, iterations = 100, alpha = 1.0, rng = None):
+        """Initialises an instance of NRPA
+
+        Args:
+            s0: the starting state
+            level = 2: the nesting level of the top search
+            iterations = 100: the number of searches of level l - 1 per search of level l
+            alpha = 1.0: the learning rate of the policy adaptation
+            rng = None: a seed, random.Random or NumPy Generator for the rollouts, the global random module if None
+        """
+        self.root = Node(s0, None, None)
+        self.level = level
+        self.iterations = iterations
+        self.alpha = alpha
+        self.rng = Utils.makeRng(rng)
+
+        self.visited = 0
+        self.tree = {s0}
+        self.goal = None
+        self.target = len(s0.ps) - 1
+
+    def run(self):
+        """Runs the top search
+
+        Returns:
+            The list of nodes from the root to the goal node, or None if the best sequence found does not solve the puzzle
+        """
+        score, seq = self.nested(self.level, dict())
+        if score < self.target:
+            return None
+        self.goal = Sequence.toRoute(self.root, seq)[-1]
+        return self.goal.getRoute()
+
+    def nested(self, level, policy):
+        """Performs a search of a given level
+
+        Args:
+            level: the nesting level, 0 is a single rollout
+            policy: dictionary from action key to weight, changed by this method
+
+        Returns:
+            A (score, sequence) tuple, sequence being the list of actions from the starting state
+        """
+        if level == 0:
+            return self.rollout(policy)
+
+        best = (-1, [])
+        for _ in range(self.iterations):
+            score, seq = self.nested(level - 1, dict(policy))
+            if score >= best[0]:
+                best = (score, seq)
+                if score == self.target:
+                    break
+            self.adapt(policy, best[1])
+        return best
+
+    def rollout(self, policy):
+        """Plays actions from the starting state, sampled from the policy
+
+        Args:
+            policy: dictionary from action key to weight, missing keys weigh 0
+
+        Returns:
+            A (score, sequence) tuple
+        """
+        s = self.root.s
+        seq = []
+        while True:
+            actions = s.getLiveActions()
+            self.visited += 1
+            if len(actions) == 0:
+                return len(seq), seq
+
+            weights = [math.exp(policy.get(Utils.actionKey(s, p1, p2), 0)) for (p1, p2) in actions]
+            p1, p2 = self.rng.choices(actions, weights)[0]
+            seq.append((p1, p2))
+            s = s.nextState(p1, p2)
+
+    def adapt(self, policy, seq):
+        """Moves the policy towards a sequence, by a gradient step on its log-likelihood
+
+        Args:
+            policy: dictionary from action key to weight, changed in place
+            seq: the list of actions from the starting state
+        """
+        old = dict(policy)
+        s = self.root.s
+        for (p1, p2) in seq:
+            actions = s.getActions()
+            keys = [Utils.actionKey(s, a[0], a[1]) for a in actions]
+            weights = [math.exp(old.get(key, 0)) for key in keys]
+            z = sum(weights)
+
+            policy[Utils.actionKey(s, p1, p2)] = policy.get(Utils.actionKey(s, p1, p2), 0) + self.alpha
+            for key, w in zip(keys, weights):
+                policy[key] = policy.get(key, 0) - self.alpha * w / z
+
+            s = s.nextState(p1, p2)
+            self.tree.add(s)
+
+class Sequence():
+    """Helpers for sequences of actions
+    """
+    @classmethod
+    def toRoute(cls, root, seq):
+        """Turns a sequence of actions from the root's state into a route of nodes
+
+        Args:
+            root: the node to start from
+            seq: list of (p1, p2) actions, using the pieces of the root's state
+
+        Returns:
+            The list of nodes from root to the node reached by the last action
+        """
+        route = [root]
+        for (p1, p2) in seq:
+            node = route[-1]
+            route.append(Node(node.s.nextState(p1, p2), node, (p1, p2)))
+        return route
@@ -0,0 +1,188 @@
+from solve import Solver
+from corpus import Corpus
+from utils import Utils
+import argparse
+import json
+import multiprocessing as mp
+import queue
+import time
+
+class Portfolio():
+    """Races several solver configurations on the same puzzle
+
+    Every configuration runs in its own process. The first solution found is returned and the other processes are terminated,
+    so a puzzle is solved as fast as the best configuration for it, without knowing in advance which one that is.
+    Solutions are sent back as moves (see Solver.moves) and replayed on the starting state.
+
+    Attributes:
+        s0: the starting state
+        configs: a list of (solver name, params) pairs, see Solver.make
+        visited: the number of states visited by the winning configuration
+        tree: the set of states on the winning route
+        goal: the goal node, once found
+        winner: the label of the winning configuration, or None
+        results: the result dictionaries received before the race ended, see Solver.solve
+    """
+
+    # the default portfolio
+    default = [
+        ("mcts", {"h": "R", "c": 2, "d": 3}),
+        ("mcts", {"h": "R", "c": 0.5, "d": 10}),
+        ("backtrack", {"h": "R", "_tree": True}),
+        ("backtrack", {"h": "R", "_tree": False})
+    ]
+
+    def __init__(self, s0, configs = None, timeout = None, seed = None, log = None):
+        """Initialises an instance of Portfolio
+
+        Args:
+            s0: the starting state
+            configs = None: a list of (solver name, params) pairs, Portfolio.default if None
+            timeout = None: time limit of the race in seconds
+            seed = None: if given, configuration i gets its own random stream, seeded with Utils.streamSeed(seed, i)
+            log = None: path of a JSON lines file to append the outcome of every race to
+        """
+        self.s0 = s0
+        self.configs = configs if configs is not None else Portfolio.default
+        self.timeout = timeout
+        self.seed = seed
+        self.log = log
+
+        self.visited = 0
+        self.tree = {s0}
+        self.goal = None
+        self.winner = None
+        self.results = []
+
+    @classmethod
+    def label(cls, name, params):
+        """Names a configuration, e.g. mcts(c=2, d=3, h=R)
+
+        Args:
+            name: a key of Solver.solvers
+            params: a dictionary of keyword arguments for the solver
+
+        Returns:
+            A string
+        """
+        return f"{name}({', '.join(f'{k}={v}' for k, v in sorted(params.items()))})"
+
+    @classmethod
+    def race(cls, results, task):
+        """Solves a puzzle in a racing process and sends back the result
+
+        Args:
+            results: the queue to put the result dictionary on
+            task: a task tuple as taken by Solver.solve, its pid being the index of the configuration
+        """
+        results.put(Solver.solve(task))
+
+    def run(self):
+        """Starts all configurations and waits for the first solution
+
+        Returns:
+            The list of nodes from a new root to the goal node, or None if no configuration solved the puzzle in time
+        """
+        start = time.perf_counter()
+        results = mp.Queue()
+        procs = []
+        for i, (name, params) in enumerate(self.configs):
+            task = (i, self.s0, name, params, self.timeout, None if self.seed is None else Utils.streamSeed(self.seed, i))
+            proc = mp.Process(target=Portfolio.race, args=(results, task), daemon=True)
+            proc.start()
+            procs.append(proc)
+
+        route = None
+        try:
+            while route is None and len(self.results) < len(procs):
+                left = None if self.timeout is None else start + self.timeout - time.perf_counter()
+                try:
+                    # poll so that crashed processes are noticed
+                    result = results.get(timeout=0.1 if left is None else max(0, min(left, 0.1)))
+                except queue.Empty:
+                    if left is not None and left <= 0:
+                        break
+                    if not any(proc.is_alive() for proc in procs) and results.empty():
+                        break
+                    continue
+
+                self.results.append(result)
+                if result["status"] == "solved":
+                    route = Solver.replay(self.s0, result["route"])
+                    self.winner = Portfolio.label(*self.configs[result["pid"]])
+                    self.visited = result["visited"]
+        finally:
+            for proc in procs:
+                if proc.is_alive():
+                    proc.terminate()
+            for proc in procs:
+                proc.join()
+            results.close()
+
+        if route is not None:
+            self.goal = route[-1]
+            self.tree = {node.s for node in route}
+
+        if self.log is not None:
+            record = {
+                "n": len(self.s0.ps),
+                "winner": self.winner,
+                "entrants": [Portfolio.label(name, params) for name, params in self.configs],
+                "wall": time.perf_counter() - start
+            }
+            with open(self.log, "a") as file:
+                file.write(json.dumps(record) + "\n")
+
+        return route
+
+    @classmethod
+    def winRates(cls, log):
+        """Computes the win rate of every configuration from a race log
+
+        Args:
+            log: path of a JSON lines file written by Portfolio.run
+
+        Returns:
+            A dictionary from configuration label to (wins, races) tuples
+        """
+        rates = dict()
+        with open(log) as file:
+            for line in file:
+                record = json.loads(line)
+                for label in record["entrants"]:
+                    wins, races = rates.get(label, (0, 0))
+                    rates[label] = (wins + (label == record["winner"]), races + 1)
+        return rates
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Race the default portfolio of solvers on a corpus of puzzles")
+    parser.add_argument("corpus", nargs="?", help="a binary corpus or a file of FEN-like lines, - reads lines from standard input")
+    parser.add_argument("--timeout", type=float, default=None, help="time limit per puzzle in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log", default="portfolio.jsonl", help="file to append the race outcomes to")
+    parser.add_argument("--rates", action="store_true", help="print the win rates in the log and exit")
+    args = parser.parse_args(argv)
+
+    if args.rates:
+        rates = Portfolio.winRates(args.log)
+        for label, (wins, races) in sorted(rates.items(), key=lambda item: -item[1][0] / item[1][1]):
+            print(f"{label:48} {wins:6} / {races:<6} {wins / races:6.1%}")
+        return
+    if args.corpus is None:
+        parser.error("a corpus is required unless --rates is given")
+
+    for pid, s0 in enumerate(Corpus.read(args.corpus)):
+        portfolio = Portfolio(s0, timeout=args.timeout, seed=args.seed, log=args.log)
+        route = portfolio.run()
+        result = {
+            "pid": pid,
+            "n": len(s0.ps),
+            "winner": portfolio.winner,
+            "route": Solver.moves(route) if route is not None else None
+        }
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
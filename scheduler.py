@@ -0,0 +1,227 @@
+from solve import Solver
+from mcts import RolloutCache
+from state import State
+from utils import Utils
+from multiprocessing import Pool
+import gc
+import itertools
+import resource
+import time
+
+class Scheduler():
+    """Solves many puzzles in one process by interleaving their searches
+
+    Up to width searches are in flight at once. They take turns in a round-robin, each advancing by chunk iterations
+    through its step method (see MCTS.step and Backtrack.step), and a finished search makes room for the next puzzle.
+    Small puzzles are so done within a few turns without paying for a process or waiting behind a large one.
+    The time limit of a puzzle counts the time of its own turns only.
+
+    State shared by the searches of a scheduler:
+        memo: one RolloutCache for all MCTS searches with heuristics and without RAVE, heuristic rollouts give the same outcome whatever the puzzle
+        cache: a SolutionCache looked up before a puzzle is started and filled with the solutions found
+    The automatic garbage collector is switched off during the turns, the trees of MCTS link parents and children both ways
+    so they are only freed by a collection, which is run once every collect finished puzzles instead of after every few
+    thousand allocations. It is switched back on before a result is yielded, so the caller runs with the usual settings.
+    Only MCTS and Backtrack are interleaved, other solvers do most of their work in a single call and would hold up the round.
+
+    Attributes:
+        name: the solver, "mcts" or "backtrack"
+        params: the parameters of the solver
+        finished: the number of puzzles finished
+        turns: the number of turns given
+    """
+    # solvers that do a bounded amount of work per call of their step method
+    steppable = ["mcts", "backtrack"]
+
+    # the scheduler of a worker process, see Scheduler.startWorker
+    workerScheduler = None
+
+    def __init__(self, name = "mcts", params = None, width = 16, chunk = 32, timeout = None, memo = 100000, cache = None, collect = 64):
+        """Initialises an instance of Scheduler
+
+        Args:
+            name = "mcts": the solver, "mcts" or "backtrack"
+            params = None: a dictionary of solver parameters, see Solver.make
+            width = 16: the number of searches in flight
+            chunk = 32: the iterations (MCTS) or visited nodes (Backtrack) per turn
+            timeout = None: time limit per puzzle in seconds
+            memo = 100000: the size of the rollout cache shared by MCTS searches with heuristics and without RAVE, None to share none
+            cache = None: a SolutionCache to look puzzles up in and add solutions to
+            collect = 64: the number of finished puzzles between garbage collections
+
+        Raises:
+            ValueError: if name is not a solver that can be interleaved
+        """
+        if name not in Scheduler.steppable:
+            raise ValueError(f"cannot interleave {name}, only {', '.join(Scheduler.steppable)}")
+        self.name = name
+        self.params = dict(params) if params is not None else dict()
+        self.width = width
+        self.chunk = chunk
+        self.timeout = timeout
+        self.cache = cache
+        self.collect = collect
+        if memo is not None and name == "mcts" and self.params.get("h") is not None and self.params.get("memo") is None and self.params.get("rave") is None:
+            self.params["memo"] = RolloutCache(memo)
+
+        self.finished = 0
+        self.turns = 0
+
+    def run(self, tasks):
+        """Solves puzzles
+
+        Args:
+            tasks: an iterable of (pid, state, seed) tuples, the state may be given as its State.toBytes encoding and seed may be None
+
+        Yields:
+            Result dictionaries as returned by Solver.solve, in the order the puzzles are finished
+        """
+        tasks = iter(tasks)
+        # [pid, starting state, solver, params, wall, cpu]
+        flight = []
+        while True:
+            while len(flight) < self.width:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                entry, result = self.start(task)
+                if result is not None:
+                    yield result
+                else:
+                    flight.append(entry)
+            if len(flight) == 0:
+                return
+
+            for entry in list(flight):
+                solver = entry[2]
+                start = time.perf_counter()
+                start_cpu = time.process_time()
+                enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    route = solver.step(self.chunk)
+                finally:
+                    if enabled:
+                        gc.enable()
+                entry[4] += time.perf_counter() - start
+                entry[5] += time.process_time() - start_cpu
+                self.turns += 1
+
+                if solver.done:
+                    status = "solved" if route is not None else "unsolved"
+                elif self.timeout is not None and entry[4] >= self.timeout:
+                    status = "timeout"
+                else:
+                    continue
+                flight.remove(entry)
+                yield self.finish(entry, status, route)
+
+    def start(self, task):
+        """Creates the search of a puzzle, or answers it from the cache
+
+        Returns:
+            A (flight entry, None) tuple, or (None, result) for a cached puzzle
+        """
+        pid, s0, seed = task
+        if isinstance(s0, bytes):
+            s0 = State.fromBytes(s0)
+        params = self.params if seed is None else dict(self.params, rng=seed)
+        if self.cache is not None:
+            result = Solver.cached(pid, s0, self.cache)
+            if result is not None:
+                return None, result
+        return [pid, s0, Solver.make(self.name, s0, params), params, 0, 0], None
+
+    def finish(self, entry, status, route):
+        """Builds the result of a finished puzzle, stores its solution and collects garbage when due
+        """
+        pid, s0, solver, params, wall, cpu = entry
+        result = {
+            "pid": pid,
+            "n": len(s0.ps),
+            "solver": self.name,
+            "status": status,
+            "route": Solver.moves(route) if route is not None else None,
+            "visited": solver.visited,
+            "tree_size": len(solver.tree),
+            "wall": wall,
+            "cpu": cpu,
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+        if getattr(solver, "stats", None) is not None:
+            result["stats"] = solver.stats.asDict()
+        if self.cache is not None and route is not None:
+            # the parameters of this puzzle, with its seed, leaving out the shared rollout cache
+            params = {k: v for k, v in params.items() if k != "memo"}
+            self.cache.put(s0, result["route"], self.name, params, solver.visited, wall)
+
+        self.finished += 1
+        if self.collect is not None and self.finished % self.collect == 0:
+            gc.collect()
+        return result
+
+    @classmethod
+    def startWorker(cls, name, params, width, timeout, fn = None, wait = 30):
+        """Creates the scheduler of a worker process, meant as the initializer of a pool
+
+        The scheduler, and so its rollout cache, lives as long as the worker and solves all of its batches.
+
+        Args:
+            name, params, width, timeout: as taken by cls
+            fn = None: the path of a SolutionCache to open, see Solver.openCache
+            wait = 30: the timeout of the SolutionCache in seconds
+        """
+        if fn is not None:
+            Solver.openCache(fn, wait)
+        cls.workerScheduler = cls(name, params, width, timeout=timeout, cache=Solver.workerCache)
+
+    @classmethod
+    def solveBatch(cls, tasks):
+        """Solves a batch of puzzles with the scheduler of the worker process, see cls.startWorker
+
+        Args:
+            tasks: a list of tasks as taken by self.run
+
+        Returns:
+            The list of result dictionaries
+        """
+        return list(cls.workerScheduler.run(tasks))
+
+    @classmethod
+    def batches(cls, tasks, size):
+        """Lazily groups tasks into lists of size tasks, with their states encoded, see Solver.encode
+        """
+        tasks = iter(tasks)
+        while True:
+            batch = [Solver.encode(task) for task in itertools.islice(tasks, size)]
+            if len(batch) == 0:
+                return
+            yield batch
+
+    @classmethod
+    def solveAll(cls, states, name, params, workers = 1, width = 16, timeout = None, seed = None, cache = None):
+        """Solves many puzzles with a scheduler per worker process, see Solver.solveAll
+
+        Args:
+            states: an iterable of starting states, puzzle ids are their positions
+            name: a key of Solver.solvers
+            params: a dictionary of keyword arguments for the solver
+            workers = 1: the number of worker processes, 1 solves in this process
+            width = 16: the number of searches in flight per process
+            timeout = None: time limit per puzzle in seconds
+            seed = None: if given, puzzle pid is solved with its own random stream, seeded with Utils.streamSeed(seed, pid)
+            cache = None: a SolutionCache shared by the workers
+
+        Yields:
+            Result dictionaries, in the order the puzzles are finished
+        """
+        tasks = ((pid, s0, None if seed is None else Utils.streamSeed(seed, pid)) for pid, s0 in enumerate(states))
+        if workers == 1:
+            yield from cls(name, params, width, timeout=timeout, cache=cache).run(tasks)
+            return
+
+        # batches of a few widths, so the workers stay busy until the end, read from states as the pool takes them
+        initargs = (name, params, width, timeout) + ((cache.fn, cache.timeout) if cache is not None else ())
+        with Pool(workers, initializer=cls.startWorker, initargs=initargs) as pool:
+            for results in pool.imap_unordered(cls.solveBatch, cls.batches(tasks, 4 * width)):
+                yield from results
@@ -0,0 +1,233 @@
+from solve import Solver
+from cache import SolutionCache
+from state import State
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing as mp
+
+class Busy(Exception):
+    """Raised when a puzzle is submitted while the queue of the service is full
+    """
+
+class Service():
+    """An asyncio front end solving puzzles in a bounded pool of worker processes
+
+    Concurrent requests for the same puzzle, by canonical FEN, share a single solve.
+    At most queue solves are queued or running in the pool at once, further puzzles are rejected with Busy instead of piling up.
+    A solve keeps counting until its pool job ends, also when every request for it has given up in the meantime.
+    Every request has its own deadline; a request giving up does not stop the solve while other requests wait for it,
+    and a solve nobody waits for any more is dropped if it has not started yet.
+
+    The wire protocol is one JSON object per line, see Service.handle.
+
+    Attributes:
+        solver: the name of the solver, a key of Solver.solvers
+        params: the parameters of the solver
+        timeout: the time limit of a single solve in seconds, or None
+        limit: the maximum number of pool jobs queued or running
+        inflight: a dictionary from FEN to the asyncio future of the job solving it
+        jobs: the set of pool futures that may not have finished, see self.load
+        waiters: a dictionary from solve future to the number of requests waiting for it
+        solves: the number of solves started
+    """
+    def __init__(self, workers = 1, queue = 64, solver = "mcts", params = None, timeout = None, cache = None):
+        """Initialises an instance of Service
+
+        Args:
+            workers = 1: the number of worker processes
+            queue = 64: the maximum number of distinct puzzles queued or being solved
+            solver = "mcts": the name of the solver, a key of Solver.solvers
+            params = None: a dictionary of solver parameters, see Solver.make
+            timeout = None: the time limit of a single solve in seconds
+            cache = None: a SolutionCache consulted and filled by the workers
+        """
+        # forked workers would inherit the sockets of open connections and keep them from closing
+        # every worker opens its own connection to the cache, see Solver.openCache
+        init = dict(initializer=Solver.openCache, initargs=(cache.fn, cache.timeout)) if cache is not None else dict()
+        self.executor = ProcessPoolExecutor(workers, mp_context=mp.get_context("forkserver"), **init)
+        self.limit = queue
+        self.solver = solver
+        self.params = params if params is not None else dict()
+        self.timeout = timeout
+        self.cache = cache
+
+        self.inflight = dict()
+        self.jobs = set()
+        self.waiters = dict()
+        self.solves = 0
+
+    async def solve(self, s0, deadline = None):
+        """Solves a puzzle, sharing the solve with concurrent requests for the same puzzle
+
+        Args:
+            s0: the starting state
+            deadline = None: seconds to wait for the solution
+
+        Returns:
+            A result dictionary as returned by Solver.solve, with status "timeout" if the deadline passed first,
+            and coalesced set to True if the solve was started by another request
+
+        Raises:
+            Busy: if the puzzle is not in flight and the queue is full
+        """
+        key = s0.toFen()
+        task = self.inflight.get(key)
+        coalesced = task is not None
+        if task is None:
+            load = self.load()
+            if load >= self.limit:
+                raise Busy(f"{load} solves queued or running")
+            # the first request bounds the time of the solve
+            limits = [t for t in (deadline, self.timeout) if t is not None]
+            timeout = min(limits) if len(limits) > 0 else None
+            task = asyncio.wrap_future(self.submit(s0, timeout))
+            self.inflight[key] = task
+            task.add_done_callback(functools.partial(self.forget, key))
+
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), deadline)
+        except asyncio.TimeoutError:
+            return {"n": len(s0.ps), "solver": self.solver, "status": "timeout", "route": None, "coalesced": coalesced}
+        finally:
+            self.waiters[task] -= 1
+            if self.waiters[task] == 0:
+                del self.waiters[task]
+                if not task.done():
+                    # nobody is waiting, drop the job if it is still queued, a running job counts until it ends
+                    task.cancel()
+
+        return dict(result, coalesced=coalesced)
+
+    def load(self):
+        """Returns the number of pool jobs queued or running
+        """
+        self.jobs = {job for job in self.jobs if not job.done()}
+        return len(self.jobs)
+
+    def submit(self, s0, timeout):
+        """Submits Solver.solve to the pool
+
+        Returns:
+            The concurrent.futures.Future of the job
+        """
+        self.solves += 1
+        task = (self.solves, s0.toBytes(), self.solver, self.params, timeout, None)
+        job = self.executor.submit(Solver.solveInWorker, task)
+        self.jobs.add(job)
+        return job
+
+    def forget(self, key, task):
+        """Removes a finished or cancelled solve from the puzzles in flight
+        """
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+
+    async def handle(self, reader, writer):
+        """Serves one connection
+
+        Every line is a JSON request, answered by one JSON line carrying the same id. Answers are written as solves finish,
+        so they may come out of order. Requests:
+            {"id": ..., "fen": ..., "deadline": seconds}: solves a puzzle, deadline is optional
+            {"id": ..., "cancel": id}: cancels the pending request with the given id, which is answered with status "cancelled"
+        Solve requests need an id that is not pending on the connection, otherwise they are answered with status "error".
+
+        Args:
+            reader: the asyncio stream reader of the connection
+            writer: the asyncio stream writer of the connection
+        """
+        pending = dict()
+
+        def send(answer):
+            writer.write((json.dumps(answer) + "\n").encode())
+
+        async def answer(rid, s0, deadline):
+            try:
+                result = await self.solve(s0, deadline)
+                send(dict(result, id=rid))
+            except Busy as e:
+                send({"id": rid, "status": "busy", "error": str(e)})
+            except Exception as e:
+                # e.g. a broken worker pool, the connection carries on
+                send({"id": rid, "status": "error", "error": repr(e)})
+            except asyncio.CancelledError:
+                if writer.is_closing():
+                    return
+                send({"id": rid, "status": "cancelled"})
+            finally:
+                pending.pop(rid, None)
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                request = rid = None
+                try:
+                    request = json.loads(line)
+                    rid = request.get("id")
+                    if "cancel" in request:
+                        if request["cancel"] in pending:
+                            pending[request["cancel"]].cancel()
+                        continue
+                    if rid is None or rid in pending:
+                        raise ValueError("a request needs an id that is not pending")
+                    s0 = State.fromFen(request["fen"])
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    send({"id": rid, "status": "error", "error": repr(e)})
+                    continue
+                pending[rid] = asyncio.ensure_future(answer(rid, s0, request.get("deadline")))
+            # the client is done sending, answer what it asked for
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+        finally:
+            writer.close()
+            for task in list(pending.values()):
+                task.cancel()
+
+    async def serve(self, path = None, host = "127.0.0.1", port = 8765):
+        """Serves requests until cancelled
+
+        Args:
+            path = None: the path of a Unix socket to listen on, TCP is used if None
+            host = "127.0.0.1": the TCP host
+            port = 8765: the TCP port
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """Shuts the worker pool down
+        """
+        self.executor.shutdown(cancel_futures=True)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Serve Solo Chess solutions over a Unix socket or TCP, one JSON object per line")
+    parser.add_argument("--socket", default=None, help="path of a Unix socket to listen on instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--queue", type=int, default=64, help="maximum number of distinct puzzles in flight")
+    parser.add_argument("--solver", choices=sorted(Solver.solvers), default="mcts")
+    parser.add_argument("--h", default="R", help="heuristic, 'none' to disable")
+    parser.add_argument("--timeout", type=float, default=None, help="time limit per solve in seconds")
+    parser.add_argument("--cache", default=None, help="SQLite file of known solutions to look up and add to")
+    args = parser.parse_args(argv)
+
+    cache = SolutionCache(args.cache) if args.cache is not None else None
+    service = Service(args.workers, args.queue, args.solver, {"h": None if args.h == "none" else args.h}, args.timeout, cache)
+    try:
+        asyncio.run(service.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+from mcts import MCTS, Node
+from backtrack import Backtrack
+from nested import NMCS, NRPA
+from beam import Beam
+from bestfirst import BestFirst
+from bidirectional import Bidirectional
+from corpus import Corpus
+from cache import SolutionCache
+from utils import Utils
+from state import State
+from multiprocessing import Pool
+import argparse
+import functools
+import inspect
+import json
+import resource
+import signal
+import sys
+import threading
+import time
+
+class Timeout(Exception):
+    """Raised inside a solver when its time budget runs out
+    """
+
+class Solver():
+    """Runs the solvers on puzzles in a uniform way
+
+    Every solver class takes a starting state as its first argument, has a run() method returning the route
+    to the goal node (or None), and keeps visited and tree attributes. This class creates solvers by name,
+    times them and turns their routes into plain move lists that can be stored and replayed.
+    """
+
+    # the SolutionCache of a worker process, opened once per worker by cls.openCache
+    workerCache = None
+
+    # solver classes by name
+    solvers = {
+        "mcts": MCTS,
+        "backtrack": Backtrack,
+        "nmcs": NMCS,
+        "nrpa": NRPA,
+        "beam": Beam,
+        "bestfirst": BestFirst,
+        "bidirectional": Bidirectional
+    }
+
+    @classmethod
+    def make(cls, name, s0, params):
+        """Creates a solver by name
+
+        Parameters the solver class does not accept are ignored, so one set of parameters can be shared by several solvers.
+
+        Args:
+            name: a key of cls.solvers
+            s0: the starting state
+            params: a dictionary of keyword arguments for the solver
+
+        Returns:
+            A solver object
+        """
+        solver = cls.solvers[name]
+        accepted = inspect.signature(solver).parameters
+        return solver(s0, **{k: v for k, v in params.items() if k in accepted})
+
+    @classmethod
+    def moves(cls, route):
+        """Turns a route of nodes into a list of moves
+
+        A move is written as the capturing piece and the two squares, e.g. Qd4xf6.
+
+        Args:
+            route: a list of nodes from the root to a goal node
+
+        Returns:
+            A list of strings, one per capture
+        """
+        moves = []
+        for node in route[1:]:
+            p1, p2 = node.prevAction
+            square = node.parent.s.square
+            moves.append(f"{p1}{Utils.squareName(square[p1])}x{Utils.squareName(square[p2])}")
+        return moves
+
+    @classmethod
+    def replay(cls, s0, moves):
+        """Plays a list of moves from a starting state, the inverse of cls.moves
+
+        Args:
+            s0: the starting state
+            moves: a list of moves as returned by cls.moves
+
+        Returns:
+            A list of nodes from a new root node to the final node
+        """
+        node = Node(s0, None, None)
+        route = [node]
+        for move in moves:
+            q1, q2 = move[1:].split("x")
+            s = node.s
+            p1 = s.topiece[Utils.parseSquare(q1)]
+            p2 = s.topiece[Utils.parseSquare(q2)]
+            if not s.valCap(p1, p2):
+                raise ValueError(f"illegal move {move}")
+            node = Node(s.nextState(p1, p2), node, (p1, p2))
+            route.append(node)
+        return route
+
+    @classmethod
+    def solve(cls, task, cache = None):
+        """Solves a single puzzle and measures the solver
+
+        Meant to be run in a worker process. The time limit is enforced with SIGALRM,
+        so it only applies when called from the main thread of a process.
+
+        Args:
+            task: a (pid, state, solver name, params, timeout, seed) tuple, timeout in seconds or None.
+                The state may be given as its State.toBytes encoding.
+                If seed is not None, it is passed to the solver as its rng parameter, overriding the one in params.
+            cache = None: a SolutionCache which is looked up before solving and which solutions are added to
+
+        Returns:
+            A dictionary with the result and measurements, ready to be written as JSON.
+            Results served from the cache have status "cached" and the measurements of the original solve.
+        """
+        pid, s0, name, params, timeout, seed = task
+        if isinstance(s0, bytes):
+            s0 = State.fromBytes(s0)
+        if seed is not None:
+            params = dict(params, rng=seed)
+        if cache is not None:
+            result = cls.cached(pid, s0, cache)
+            if result is not None:
+                return result
+
+        solver = cls.make(name, s0, params)
+
+        alarm = timeout is not None and threading.current_thread() is threading.main_thread()
+        if alarm:
+            signal.signal(signal.SIGALRM, cls.expire)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+
+        route = None
+        status = "unsolved"
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            route = solver.run()
+            if route is not None:
+                status = "solved"
+        except Timeout:
+            status = "timeout"
+        finally:
+            if alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+
+        result = {
+            "pid": pid,
+            "n": len(s0.ps),
+            "solver": name,
+            "status": status,
+            "route": cls.moves(route) if route is not None else None,
+            "visited": solver.visited,
+            "tree_size": len(solver.tree),
+            "wall": wall,
+            "cpu": cpu,
+            # high-water mark of the worker process, in kilobytes
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+        if getattr(solver, "stats", None) is not None:
+            result["stats"] = solver.stats.asDict()
+        if cache is not None and route is not None:
+            cache.put(s0, result["route"], name, params, solver.visited, wall)
+        return result
+
+    @classmethod
+    def cached(cls, pid, s0, cache):
+        """Looks a puzzle up in a SolutionCache
+
+        Returns:
+            A result dictionary like cls.solve with status "cached" and the measurements of the original solve, or None if the puzzle is not in the cache
+        """
+        wall = time.perf_counter()
+        entry = cache.get(s0)
+        if entry is None:
+            return None
+        return {
+            "pid": pid,
+            "n": len(s0.ps),
+            "solver": entry["solver"],
+            "status": "cached",
+            "route": entry["moves"],
+            "visited": entry["visited"],
+            "tree_size": 0,
+            "wall": entry["wall"],
+            "cpu": 0,
+            "lookup": time.perf_counter() - wall,
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+
+    @classmethod
+    def expire(cls, signum, frame):
+        raise Timeout()
+
+    @classmethod
+    def solveAll(cls, states, name, params, workers = 1, timeout = None, isolate = False, seed = None, cache = None):
+        """Solves many puzzles in a pool of worker processes
+
+        Args:
+            states: an iterable of starting states, puzzle ids are their positions
+            name: a key of cls.solvers
+            params: a dictionary of keyword arguments for the solver
+            workers = 1: the number of worker processes, 1 solves in this process
+            timeout = None: time limit per puzzle in seconds
+            isolate = False: use a fresh worker process per puzzle, so peak_rss is measured per puzzle
+            seed = None: if given, puzzle pid is solved with its own random stream, seeded with Utils.streamSeed(seed, pid)
+            cache = None: a SolutionCache shared by the workers, see cls.solve
+
+        Yields:
+            Result dictionaries as returned by cls.solve, in the order the puzzles are finished
+        """
+        tasks = ((pid, s0, name, params, timeout, None if seed is None else Utils.streamSeed(seed, pid)) for pid, s0 in enumerate(states))
+
+        if workers == 1 and not isolate:
+            yield from map(functools.partial(cls.solve, cache=cache), tasks)
+            return
+
+        # every worker opens its own connection once, instead of unpickling the cache with every task
+        initializer, initargs = (cls.openCache, (cache.fn, cache.timeout)) if cache is not None else (None, ())
+        with Pool(workers, maxtasksperchild=1 if isolate else None, initializer=initializer, initargs=initargs) as pool:
+            yield from pool.imap_unordered(cls.solveInWorker, map(cls.encode, tasks))
+
+    @classmethod
+    def openCache(cls, fn, timeout = 30):
+        """Opens the SolutionCache of a worker process, meant as the initializer of a pool
+
+        Args:
+            fn: the path of the database file
+            timeout = 30: seconds to wait for another process holding the write lock
+        """
+        cls.workerCache = SolutionCache(fn, timeout)
+
+    @classmethod
+    def solveInWorker(cls, task):
+        """Solves a task with the cache of the worker process, see cls.openCache and cls.solve
+        """
+        return cls.solve(task, cls.workerCache)
+
+    @classmethod
+    def encode(cls, task):
+        """Replaces the state of a task by its State.toBytes encoding, which is much cheaper to send to a worker process
+
+        States with pieces off the board cannot be encoded and are sent as they are.
+        """
+        try:
+            return (task[0], task[1].toBytes()) + task[2:]
+        except ValueError:
+            return task
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Solve a corpus of Solo Chess puzzles, writing one JSON line per puzzle")
+    parser.add_argument("corpus", help="a binary corpus or a file of FEN-like lines, - reads lines from standard input")
+    parser.add_argument("--solver", choices=sorted(Solver.solvers), default="mcts")
+    parser.add_argument("--h", default="R", help="heuristic, 'none' to disable")
+    parser.add_argument("--c", type=float, default=2, help="exploration coefficient of MCTS")
+    parser.add_argument("--d", type=int, default=3, help="percentage of random selections in MCTS")
+    parser.add_argument("--no-tree", dest="_tree", action="store_false", help="disable the transposition set of Backtrack")
+    parser.add_argument("--pw", type=float, nargs=2, default=None, metavar=("K", "ALPHA"), help="progressive widening of MCTS")
+    parser.add_argument("--pb", type=float, default=0, help="progressive bias weight of MCTS")
+    parser.add_argument("--rave", type=float, default=None, help="RAVE equivalence parameter of MCTS")
+    parser.add_argument("--cutoff", type=int, default=None, help="rollout depth of MCTS after which positions are evaluated statically")
+    parser.add_argument("--sp", type=float, default=None, metavar="D", help="single-player MCTS with variance constant D")
+    parser.add_argument("--memo", type=int, default=None, help="size of the rollout cache of MCTS with heuristics")
+    parser.add_argument("--level", type=int, default=2, help="nesting level of NMCS and NRPA")
+    parser.add_argument("--iterations", type=int, default=100, help="iterations per level of NRPA")
+    parser.add_argument("--alpha", type=float, default=1.0, help="learning rate of NRPA")
+    parser.add_argument("--k", type=int, default=100, help="beam width of Beam")
+    parser.add_argument("--weight", type=float, default=1, help="weight of the depth in the priority of BestFirst")
+    parser.add_argument("--cap", type=int, default=None, help="maximum frontier size of BestFirst")
+    parser.add_argument("--reverse", type=int, default=2000, help="maximum number of positions of the backward search of Bidirectional")
+    parser.add_argument("--layer-workers", type=int, default=None, help="worker processes expanding each layer of Beam")
+    parser.add_argument("--stats", action="store_true", help="include the per-phase statistics of MCTS in the results")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--timeout", type=float, default=None, help="time limit per puzzle in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="derive a separate random stream for every puzzle from this seed")
+    parser.add_argument("--interleave", type=int, default=None, metavar="WIDTH",
+                        help="solve WIDTH puzzles at a time per process, interleaving their searches (mcts and backtrack)")
+    parser.add_argument("--isolate", action="store_true", help="one worker process per puzzle for exact peak memory")
+    parser.add_argument("--cache", default=None, help="SQLite file of known solutions to look up and add to")
+    parser.add_argument("--out", default="-", help="file to write the results to, - for standard output")
+    args = parser.parse_args(argv)
+
+    params = {
+        "h": None if args.h == "none" else args.h,
+        "c": args.c,
+        "d": args.d,
+        "_tree": args._tree,
+        "stats": args.stats,
+        "memo": args.memo,
+        "cutoff": args.cutoff,
+        "sp": args.sp,
+        "pw": tuple(args.pw) if args.pw is not None else None,
+        "pb": args.pb,
+        "rave": args.rave,
+        "level": args.level,
+        "iterations": args.iterations,
+        "alpha": args.alpha,
+        "k": args.k,
+        "weight": args.weight,
+        "cap": args.cap,
+        "reverse": args.reverse
+    }
+    if args.solver == "beam":
+        # not a shared key, any other solver taking workers would get the layer workers of Beam
+        params["workers"] = args.layer_workers
+
+    cache = SolutionCache(args.cache) if args.cache is not None else None
+    out = sys.stdout if args.out == "-" else open(args.out, "w")
+    try:
+        if args.interleave is not None:
+            # the scheduler builds on this module
+            from scheduler import Scheduler
+            results = Scheduler.solveAll(Corpus.read(args.corpus), args.solver, params, args.workers, args.interleave, args.timeout, args.seed, cache)
+        else:
+            results = Solver.solveAll(Corpus.read(args.corpus), args.solver, params, args.workers, args.timeout, args.isolate, args.seed, cache)
+        for result in results:
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,11 @@ class State():
         caps: a dictionary which maps a piece to the amount of captures it has left
     """
 
+    # rankTable[t1][t2][c]: the Rank heuristic value of a piece of type t1 capturing a piece of type t2 with c captures left,
+    # for every c that fits in the 4 bits State.toBytes stores, larger counts are computed by State.heuristic.
+    # Filled by buildRankTable() when this module is imported
+    rankTable = []
+
     @classmethod
     def fromFile(cls, fn):
         ls = []
@@ -33,6 +38,154 @@ class State():
 
         return cls(square, caps)
 
+    @classmethod
+    def fromFen(cls, line):
+        """Parses a state from its FEN-like description
+
+        The description has two fields separated by whitespace.
+        The first lists the ranks from y = 7 down to y = 0, separated by slashes, each from x = 0 to x = 7.
+        Pieces are written by their letter and runs of empty squares by their length, as in chess FEN.
+        The second field holds the captures left of every piece as one digit each, in the order the pieces appear in the first field.
+        When it is omitted, every piece has 2 captures left.
+
+        Args:
+            line: the description, e.g. "8/8/8/3P4/2K5/8/8/8 21"
+
+        Returns:
+            A State object
+
+        Raises:
+            ValueError: if there are not 8 ranks of 8 files, a character is not a piece letter,
+                or the number of capture counts does not match the pieces
+        """
+        fields = line.split()
+        square = dict()
+        caps = dict()
+        ps = []
+
+        ranks = fields[0].split("/") if len(fields) > 0 else []
+        if len(ranks) != 8:
+            raise ValueError(f"expected 8 ranks in '{line.strip()}', got {len(ranks)}")
+        for y, rank in zip(range(7, -1, -1), ranks):
+            x = 0
+            for c in rank:
+                if c.isdigit():
+                    x += int(c)
+                elif c in Piece.toType.values():
+                    p = Piece(c)
+                    square[p] = Square(x, y)
+                    ps.append(p)
+                    x += 1
+                else:
+                    raise ValueError(f"unknown piece '{c}' in '{line.strip()}'")
+            # a piece beyond the last file would silently leave the board
+            if x != 8:
+                raise ValueError(f"expected 8 files in rank {y + 1} of '{line.strip()}', got {x}")
+
+        if len(fields) > 1:
+            if len(fields[1]) != len(ps):
+                raise ValueError(f"expected {len(ps)} capture counts in '{line.strip()}'")
+            for p, c in zip(ps, fields[1]):
+                caps[p] = int(c)
+        else:
+            caps = None
+
+        return cls(square, caps)
+
+    def toFen(self) -> str:
+        """Describes this state in the FEN-like format read by State.fromFen
+
+        Returns:
+            The description as a single line without a trailing newline
+        """
+        for q in self.qs:
+            if not (0 <= q.x <= 7 and 0 <= q.y <= 7):
+                raise ValueError(f"square {q} is not on the board")
+
+        # pieces in reading order: from the top rank down, left to right
+        cells = sorted((8*(7 - q.y) + q.x, p) for p, q in self.square.items())
+
+        ranks = [""] * 8
+        filled = [0] * 8
+        caps = []
+        for i, p in cells:
+            r, x = divmod(i, 8)
+            if x > filled[r]:
+                ranks[r] += str(x - filled[r])
+            ranks[r] += str(p)
+            filled[r] = x + 1
+            caps.append(str(self.caps[p]))
+
+        for r in range(8):
+            if filled[r] < 8:
+                ranks[r] += str(8 - filled[r])
+        return "/".join(ranks) + " " + "".join(caps)
+
+    @classmethod
+    def fromBytes(cls, buf, offset = 0):
+        """Decodes a state written by State.toBytes
+
+        Args:
+            buf: a bytes-like object holding the encoding
+            offset = 0: the position of the encoding in buf
+
+        Returns:
+            A State object
+        """
+        occ = int.from_bytes(buf[offset:offset + 8], "little")
+        square = dict()
+        caps = dict()
+
+        pos = offset + 8
+        for i in Utils.bits(occ):
+            b = buf[pos]
+            p = Piece(Piece.toType[b >> 4])
+            square[p] = Utils.fromIndex(i)
+            caps[p] = b & 15
+            pos += 1
+
+        return cls(square, caps)
+
+    def toBytes(self) -> bytes:
+        """Encodes this state compactly, e.g. to send it to another process
+
+        The encoding is the occupied squares as a little-endian 64-bit mask (bit 8*y + x), followed by one byte per piece
+        in increasing square order, holding the type in the high four bits and the captures left in the low four.
+        Its length follows from the mask, so encodings can be concatenated, see State.packMany.
+
+        Returns:
+            A bytes object of 8 + len(self.ps) bytes
+        """
+        occ = 0
+        pieces = dict()
+        for p, q in self.square.items():
+            if not (0 <= q.x <= 7 and 0 <= q.y <= 7):
+                raise ValueError(f"square {q} is not on the board")
+            i = 8*q.y + q.x
+            occ |= 1 << i
+            pieces[i] = p.type << 4 | self.caps[p]
+        return occ.to_bytes(8, "little") + bytes(pieces[i] for i in sorted(pieces))
+
+    @classmethod
+    def packMany(cls, states) -> bytes:
+        """Encodes many states into one buffer, the inverse of State.unpackMany
+        """
+        return b"".join(s.toBytes() for s in states)
+
+    @classmethod
+    def unpackMany(cls, buf) -> list:
+        """Decodes all states in a buffer written by State.packMany
+
+        Returns:
+            A list of State objects
+        """
+        states = []
+        pos = 0
+        while pos < len(buf):
+            states.append(cls.fromBytes(buf, pos))
+            pos += 8 + int.from_bytes(buf[pos:pos + 8], "little").bit_count()
+        return states
+
     def __init__(self, square: dict, caps = None):
         """Initialises a State object
 
@@ -81,6 +234,7 @@ class State():
         An action consists of a capture by p1 of p2.
         This function doubly iterates through self.ps, and adds each (p1, p2) combination to the returned list
         if self.valCap(p1, p2) returns True.
+        Pieces are taken in square order, so equal states list their actions in the same order and seeded searches can be reproduced.
 
         Returns:
             A list of (p1, p2) tuples representing the captures that can be taken.
@@ -88,12 +242,30 @@ class State():
             p2 is the piece being captured
         """
         actions = []
-        for p1 in self.ps:
-            for p2 in self.ps:
+        square = self.square
+        ps = sorted(square, key=lambda p: (square[p].y, square[p].x))
+        for p1 in ps:
+            for p2 in ps:
                 if self.valCap(p1, p2):
                     actions.append((p1, p2))
         return actions
 
+    def getLiveActions(self) -> list:
+        """Creates the list of actions, or an empty list if this state is terminal
+
+        Same result as checking self.isTerminal() before calling self.getActions(), but the actions are only generated once.
+
+        Returns:
+            A list of (p1, p2) tuples, see self.getActions
+        """
+        if len(self.ps) == 1:
+            return []
+        actions = self.getActions()
+        # the king is stuck if it makes none of the captures
+        if not any(p1 is self.king for (p1, p2) in actions):
+            return []
+        return actions
+
     def transition(self) -> dict:
         """Returns a list of states which can be reached from this state
         
@@ -201,7 +373,18 @@ class State():
         """
         match h:
             case "R":
-                return 1/(p1.rank + self.caps[p2] * p2.rank)
+                c = self.caps[p2]
+                if c < 16:
+                    return State.rankTable[p1.type][p2.type][c]
+                return 1/(p1.rank + c * p2.rank)
+
+    @classmethod
+    def buildRankTable(cls):
+        """Precomputes the Rank heuristic for every combination of types and captures left
+        """
+        ranks = {t: Piece(l).rank for t, l in Piece.toType.items()}
+        cls.rankTable = [[[1/(ranks[t1] + c * ranks[t2]) if t1 in ranks and t2 in ranks else None for c in range(16)]
+                          for t2 in range(7)] for t1 in range(7)]
 
     def __repr__(self) -> str:
         """The representation of an object of class State
@@ -230,4 +413,7 @@ class State():
         rep1 = sorted(rep1, key=lambda x:x[0])
         rep2 = [(q, (t:=other.topiece[q].type), (c:=other.capsfromq[q])) for q in other.qs]
         rep2 = sorted(rep2, key=lambda x:x[0])
-        return rep1 == rep2
\ No newline at end of file
+        return rep1 == rep2
+
+
+State.buildRankTable()
@@ -2,8 +2,32 @@ import unittest
 from pieces import Piece
 from state import State
 from utils import Square, Utils
-from mcts import MCTS, Node
+from mcts import MCTS, Node, RolloutCache
 from generator import Generator
+from corpus import Corpus
+from backtrack import Backtrack
+from solve import Solver
+from nested import NMCS, NRPA
+from beam import Beam
+from bestfirst import BestFirst
+from bidirectional import Bidirectional
+from portfolio import Portfolio
+from cache import SolutionCache
+from service import Service, Busy
+from bench import Bench
+from scheduler import Scheduler
+from evaluate import Evaluator
+import asyncio
+import gc
+import heapq
+import importlib.util
+import itertools
+import json
+import math
+import os
+import pickle
+import random as rd
+import tempfile
 
 class TestState(unittest.TestCase):
     def test_alignVer(self):
@@ -459,6 +483,699 @@ class TestPuzzles(unittest.TestCase):
         mcts = MCTS(s0)
         mcts.run()
 
+class TestBacktrack(unittest.TestCase):
+    def test_rankTable(self):
+        for t1 in "QRBNPK":
+            for t2 in "QRBNP":
+                p1 = Piece(t1)
+                p2 = Piece(t2)
+                for c in range(16):
+                    self.assertEqual(State.rankTable[p1.type][p2.type][c], 1/(p1.rank + c * p2.rank))
+
+        # captures left beyond the table, and those a corpus record can hold
+        k = Piece("K")
+        q = Piece("Q")
+        for c in [12, 20]:
+            s = State({k: Square(0, 0), q: Square(1, 1)}, {k: 2, q: c})
+            self.assertEqual(s.heuristic("R", k, q), 1/(k.rank + c * q.rank))
+
+    def test_children(self):
+        s0 = Generator().getPuzzle(8)
+        node = Node(s0, None, None)
+        bt = Backtrack(s0, h = "R")
+        actions = s0.getActions()
+
+        children = bt.children(node, actions)
+        first = next(children)
+
+        # the best capture comes first, and only its state has been created
+        best = max(s0.heuristic("R", p1, p2) for (p1, p2) in actions)
+        self.assertEqual(s0.heuristic("R", *first.prevAction), best)
+        self.assertEqual(len(bt.tree), 2)
+
+        hs = [s0.heuristic("R", *first.prevAction)] + [s0.heuristic("R", *c.prevAction) for c in children]
+        self.assertEqual(hs, sorted(hs, reverse=True))
+
+class TestStats(unittest.TestCase):
+    def test_disabled(self):
+        s0 = Generator().getPuzzle(5)
+        mcts = MCTS(s0)
+        self.assertIsNone(mcts.stats)
+        mcts.run()
+
+    def test_counters(self):
+        s0 = Generator().getPuzzle(9)
+        mcts = MCTS(s0, h = "R", stats = True)
+        mcts.run()
+        stats = mcts.stats.asDict()
+
+        # the phases account for every visited node
+        self.assertEqual(sum(p["visited"] for p in stats["phases"].values()), mcts.visited)
+        self.assertEqual(sum(stats["rollouts"].values()), stats["phases"]["simulate"]["calls"])
+        self.assertEqual(stats["created"]["expansion"] - stats["discarded"]["transposition"], len(mcts.tree) - 1)
+        self.assertTrue(0 <= stats["hit_rate"] <= 1)
+
+        json.loads(mcts.stats.toJson())
+
+class TestRolloutCache(unittest.TestCase):
+    def test_simulate(self):
+        # the heuristic rollout of this puzzle is lost, won ones are not stored
+        s0 = Generator(rng = 1).getPuzzle(10)
+        mcts = MCTS(s0, h = "R", memo = 1000, rng = 0)
+
+        v1 = mcts.simulate(Node(s0, None, None))
+        self.assertTrue(v1 < 1)
+        visited = mcts.visited
+
+        # the second rollout is a single lookup
+        v2 = mcts.simulate(Node(s0, None, None))
+        self.assertEqual(v1, v2)
+        self.assertEqual(mcts.visited, visited)
+        self.assertEqual(mcts.memo.hits, 1)
+
+        # every state on the rollout was stored
+        self.assertEqual(len(mcts.memo), visited + 1)
+
+    def test_eviction(self):
+        g = Generator()
+        states = [g.getPuzzle(n) for n in [3, 4, 5]]
+        memo = RolloutCache(2)
+
+        memo.put(states[:2], 1)
+        memo.get(states[0])
+        memo.put(states[2:], 2)
+
+        # states[1] was used least recently
+        self.assertEqual(len(memo), 2)
+        self.assertIsNone(memo.get(states[1]))
+        self.assertEqual(memo.get(states[0]), 1)
+
+class TestWidening(unittest.TestCase):
+    def test_widen(self):
+        s0 = Generator().getPuzzle(10)
+        mcts = MCTS(s0, h = "R", pw = (1, 0.5))
+        root = mcts.root
+        actions = s0.getActions()
+
+        # one child at first, the best capture
+        mcts.expand(root)
+        self.assertEqual(len(root.nexts), 1)
+        best = max(s0.heuristic("R", p1, p2) for (p1, p2) in actions)
+        self.assertEqual(root.nexts[0].prior, best)
+
+        # ceil(sqrt(visits)) children later on
+        root.visits = 9
+        mcts.widen(root)
+        self.assertEqual(len(root.nexts), min(3, len(actions)))
+        priors = [n.prior for n in root.nexts]
+        self.assertEqual(priors, sorted(priors, reverse=True))
+
+    def test_run(self):
+        s0 = Generator().getPuzzle(8)
+        mcts = MCTS(s0, h = "R", pw = (2, 0.5), pb = 1)
+        route = mcts.run()
+        self.assertTrue(route[-1].s.isGoal())
+
+class TestRave(unittest.TestCase):
+    def test_amaf(self):
+        s0 = Generator(rng = 5).getPuzzle(6)
+        mcts = MCTS(s0, rave = 100, rng = 0)
+
+        # a simulation from a child of the root, which plays three captures and loses
+        mcts.expand(mcts.root)
+        node = mcts.root.nexts[0]
+        v = mcts.simulate(node)
+        self.assertTrue(v < 1)
+        self.assertEqual(len(mcts.playout), 3)
+        mcts.backprop(node, v)
+
+        # the tree action and the simulated actions were all credited
+        self.assertIn(Utils.actionKey(s0, *node.prevAction), mcts.amaf)
+        self.assertEqual(len(mcts.amaf), 1 + mcts.visited - 2)
+        self.assertTrue(all(stat == [v, 1] for stat in mcts.amaf.values()))
+        self.assertEqual(mcts.playout, [])
+
+        # a rollout cache would cut playouts short
+        with self.assertRaises(ValueError):
+            MCTS(s0, h = "R", memo = 1000, rave = 100)
+        # random rollouts leave the rollout cache unused
+        self.assertEqual(MCTS(s0, memo = 1000, rave = 100).rave, 100)
+
+    def test_run(self):
+        s0 = Generator().getPuzzle(8)
+        mcts = MCTS(s0, rave = 300)
+        route = mcts.run()
+        self.assertTrue(route[-1].s.isGoal())
+
+class TestSinglePlayer(unittest.TestCase):
+    def test_backprop(self):
+        s0 = Generator(rng = 5).getPuzzle(6)
+        mcts = MCTS(s0, sp = 1)
+        mcts.expand(mcts.root)
+        node = mcts.root.nexts[0]
+        mcts.backprop(node, 0.5)
+        mcts.backprop(node, 0.25)
+
+        for n in (node, mcts.root):
+            self.assertEqual(n.best, 0.5)
+            self.assertEqual(n.squares, 0.3125)
+        deviation = math.sqrt((0.3125 - 2 * 0.375 ** 2 + 1) / 2)
+        self.assertAlmostEqual(mcts.uct(node), 0.5 + 2 * math.sqrt(math.log(2) / 2) + deviation)
+
+        route = MCTS(Generator(rng = 5).getPuzzle(8), h = "R", sp = 1, rng = 5).run()
+        self.assertTrue(route[-1].s.isGoal())
+
+    def test_immediateWin(self):
+        k = Piece("K")
+        p1 = Piece("P")
+        square = {
+            k: Square(4, 4),
+            p1: Square(3, 3)
+        }
+        mcts = MCTS(State(square))
+
+        # the goal is noticed when it is created, before any simulation
+        mcts.expand(mcts.root)
+        self.assertIsNotNone(mcts.goal)
+        self.assertTrue(mcts.goal.s.isGoal())
+        self.assertEqual(mcts.getroute(mcts.goal)[0], mcts.root)
+
+class TestEvaluator(unittest.TestCase):
+    def test_features(self):
+        s0 = State.fromFen(Bench.fen)
+        e = Evaluator()
+        f = e.features(s0, len(s0.ps))
+
+        self.assertEqual(len(f), len(Evaluator.names))
+        self.assertTrue(all(0 <= x <= 1 for x in f))
+        self.assertEqual(f[0], 0)
+        self.assertEqual(e.features(s0, len(s0.ps), s0.getActions()), f)
+        self.assertTrue(0 <= e.value(s0, len(s0.ps)) < 1)
+
+        # weights used to label samples are found back
+        weights = [0.1, 0.5, 0.2, -0.3, 0.4, -0.1]
+        samples = [(f, weights[0] + sum(w * x for w, x in zip(weights[1:], f))) for f, _ in Evaluator.collect(
+            [Generator(rng = seed).getPuzzle(8 + seed % 5) for seed in range(40)], 2, h = None, rng = 1)]
+        fitted = Evaluator.fit(samples)
+        for w1, w2 in zip(fitted.weights, weights):
+            self.assertAlmostEqual(w1, w2, places=4)
+
+    def test_cutoff(self):
+        s0 = Generator(rng = 4).getPuzzle(10)
+        mcts = MCTS(s0, h = "R", cutoff = 0, memo = 100)
+
+        # the rollout stops at once, with the static evaluation of the node
+        v = mcts.simulate(Node(s0, None, None))
+        self.assertEqual(v, mcts.evaluator.value(s0, len(s0.ps)))
+        self.assertEqual(mcts.visited, 0)
+        self.assertEqual(len(mcts.memo), 0)
+
+        route = MCTS(s0, h = "R", cutoff = 3, rng = 4).run()
+        self.assertTrue(route[-1].s.isGoal())
+        route = Beam(s0, k = 100, evaluate = Evaluator()).run()
+        self.assertTrue(route[-1].s.isGoal())
+
+class TestCheckpoint(unittest.TestCase):
+    def search(self, mcts, iterations):
+        for _ in range(iterations):
+            cur = mcts.grow(mcts.select())
+            v = mcts.simulate(cur)
+            if v == 1:
+                return
+            mcts.backprop(cur, v)
+
+    def test_resume(self):
+        s0 = State.fromFen(Bench.fen)
+        mcts = MCTS(s0, h = "R", pw = (2, 0.5), rave = 100)
+        self.search(mcts, 200)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, "search.ckpt")
+            mcts.save(fn)
+            randomState = rd.getstate()
+            rd.seed(1)
+
+            resumed = MCTS.resume(fn)
+            self.assertEqual(rd.getstate(), randomState)
+            self.assertEqual(resumed.tree, mcts.tree)
+            self.assertEqual(resumed.visited, mcts.visited)
+            self.assertEqual(resumed.amaf, mcts.amaf)
+            self.assertEqual((resumed.pw, resumed.rave, resumed.checkpoint), ((2, 0.5), 100, fn))
+            self.assertEqual([n.visits for n in resumed.root.nexts], [n.visits for n in mcts.root.nexts])
+
+            # saving the restored search gives the same file
+            with open(fn, "rb") as file:
+                saved = file.read()
+            resumed.save(fn)
+            with open(fn, "rb") as file:
+                self.assertEqual(file.read(), saved)
+            self.assertFalse(os.path.exists(fn + ".tmp"))
+
+    def test_run(self):
+        s0 = Generator().getPuzzle(9)
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, "search.ckpt")
+            mcts = MCTS(s0, checkpoint = fn, interval = 0)
+            self.search(mcts, 50)
+            mcts.save(fn)
+
+            route = MCTS.resume(fn, interval = 0).run()
+            self.assertTrue(route[-1].s.isGoal())
+            self.assertEqual(route[0].s, s0)
+
+        # pieces off the board cannot be saved, which fails before the search starts
+        k = Piece("K")
+        p = Piece("P")
+        with self.assertRaises(ValueError):
+            MCTS(State({k: Square(0, 0), p: Square(8, 1)}), checkpoint = "search.ckpt")
+
+class TestRng(unittest.TestCase):
+    def test_reproducible(self):
+        s0 = Generator(rng = 3).getPuzzle(10)
+        self.assertEqual(Generator(rng = 3).getPuzzle(10), s0)
+
+        # equal seeds give equal searches, also from an equal state built differently
+        runs = [MCTS(s, rng = 7) for s in (s0, State.fromFen(s0.toFen()))]
+        routes = [Solver.moves(mcts.run()) for mcts in runs]
+        self.assertEqual(routes[0], routes[1])
+        self.assertEqual(runs[0].visited, runs[1].visited)
+
+        # a resumed search continues exactly like the original
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, "search.ckpt")
+            mcts = MCTS(s0, rng = 7)
+            for _ in range(20):
+                cur = mcts.grow(mcts.select())
+                mcts.backprop(cur, mcts.simulate(cur))
+            mcts.save(fn)
+            resumed = MCTS.resume(fn, rng = rd.Random())
+            self.assertEqual(Solver.moves(resumed.run()), Solver.moves(mcts.run()))
+            self.assertEqual(resumed.visited, mcts.visited)
+
+    def test_streams(self):
+        streams = Utils.spawnRngs(5, 3)
+        draws = [rng.random() for rng in streams]
+        self.assertEqual(len(set(draws)), 3)
+        self.assertEqual([rng.random() for rng in Utils.spawnRngs(5, 3)], draws)
+        self.assertIs(Utils.makeRng(streams[0]), streams[0])
+        self.assertIs(Utils.makeRng(), rd)
+
+    @unittest.skipIf(importlib.util.find_spec("numpy") is None, "numpy is not installed")
+    def test_numpy(self):
+        import numpy as np
+        rng = Utils.makeRng(np.random.default_rng(11))
+        state = rng.getstate()
+        draws = [rng.randint(0, 2) for _ in range(50)]
+        self.assertEqual(set(draws), {0, 1, 2})
+        rng.setstate(state)
+        self.assertEqual([rng.randint(0, 2) for _ in range(50)], draws)
+        self.assertEqual(rng.choices(["a", "b"], [0, 1], k = 3), ["b", "b", "b"])
+
+        s0 = Generator(rng = np.random.default_rng(1)).getPuzzle(8)
+        self.assertTrue(NMCS(s0, rng = np.random.default_rng(2)).run()[-1].s.isGoal())
+        self.assertEqual(len(Utils.spawnRngs(np.random.default_rng(3), 4)), 4)
+
+        # its state cannot be checkpointed, which fails before the search starts
+        with self.assertRaises(ValueError):
+            MCTS(s0, checkpoint = "search.ckpt", rng = np.random.default_rng(4))
+
+@unittest.skipIf(importlib.util.find_spec("numpy") is None, "numpy is not installed")
+class TestBatch(unittest.TestCase):
+    def test_captures(self):
+        from batch import Batch
+        g = Generator(rng = 2)
+        states = [g.getPuzzle(n) for n in range(2, 17) for _ in range(10)]
+        # pieces without captures left and blocked lines
+        states += [State.fromFen(Bench.fen), State.fromFen("8/8/8/3K4/8/8/8/Q6P 010")]
+
+        occ, types, caps = Batch.fromStates(states)
+        moves = Batch.captures(occ, types, caps)
+        matrix = Batch.matrix(moves)
+        for k, s in enumerate(states):
+            for p1 in s.ps:
+                for p2 in s.ps:
+                    i, j = Utils.toIndex(s.square[p1]), Utils.toIndex(s.square[p2])
+                    self.assertEqual(bool(s.valCap(p1, p2)), matrix[k, i, j])
+        self.assertEqual(list(Batch.counts(moves)), [len(s.getActions()) for s in states])
+        self.assertEqual(list(Batch.terminal(occ, types, caps)), [s.isTerminal() for s in states])
+
+    def test_fromCorpus(self):
+        from batch import Batch
+        states = [Generator(rng = 4).getPuzzle(n) for n in range(1, 17)]
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, "corpus.bin")
+            Corpus.write(fn, states)
+            with Corpus(fn) as corpus:
+                arrays = Batch.fromCorpus(corpus)
+        for a, b in zip(arrays, Batch.fromStates(states)):
+            self.assertTrue((a == b).all())
+
+class TestNested(unittest.TestCase):
+    def test_nmcs(self):
+        # a level 2 search misses the solution of a few puzzles, this one it solves
+        s0 = Generator(rng = 1).getPuzzle(8)
+        nmcs = NMCS(s0, level = 2, rng = 0)
+        route = nmcs.run()
+
+        self.assertTrue(route[-1].s.isGoal())
+        self.assertEqual(len(route), 8)
+        self.assertIs(route[0].s, s0)
+        self.assertTrue(nmcs.visited > 0)
+
+    def test_nrpa(self):
+        s0 = Generator(rng = 1).getPuzzle(7)
+        nrpa = NRPA(s0, level = 2, iterations = 50, rng = 0)
+        route = nrpa.run()
+        self.assertTrue(route[-1].s.isGoal())
+        self.assertIs(route[0].s, s0)
+
+        # the policy moves towards the sequence it is adapted to
+        seq = nrpa.rollout(dict())[1]
+        policy = dict()
+        nrpa.adapt(policy, seq)
+        p1, p2 = seq[0]
+        self.assertTrue(policy[Utils.actionKey(s0, p1, p2)] > 0)
+
+    def test_unsolvable(self):
+        k = Piece("K")
+        p = Piece("P")
+        square = {k: Square(0, 0), p: Square(5, 5)}
+        s0 = State(square)
+
+        self.assertIsNone(NMCS(s0).run())
+        self.assertIsNone(NRPA(s0, iterations = 3).run())
+
+class TestBeam(unittest.TestCase):
+    def test_run(self):
+        s0 = Generator().getPuzzle(8)
+        beam = Beam(s0, k = 1000)
+        route = beam.run()
+
+        self.assertTrue(route[-1].s.isGoal())
+        self.assertEqual(len(route), 8)
+        self.assertEqual(Solver.replay(s0, Solver.moves(route))[-1].s, route[-1].s)
+
+        # the same layers are kept when expanding in worker processes
+        parallel = Beam(s0, k = 1000, workers = 2)
+        self.assertEqual(Solver.moves(parallel.run()), Solver.moves(route))
+        self.assertEqual(parallel.visited, beam.visited)
+
+    def test_step(self):
+        s0 = State.fromFen(Bench.fen)
+        beam = Beam(s0, k = 5, evaluate = lambda s, a, s2: -len(s2.getActions()))
+        layer = beam.step([(0, beam.root)])
+
+        # at most k states, without duplicates, best first
+        self.assertTrue(0 < len(layer) <= 5)
+        self.assertEqual(len({node.s for _, node in layer}), len(layer))
+        self.assertEqual([score for score, _ in layer], sorted([score for score, _ in layer], reverse=True))
+        self.assertTrue(all(node.parent is beam.root for _, node in layer))
+
+class TestBestFirst(unittest.TestCase):
+    def test_run(self):
+        s0 = Generator(rng = 6).getPuzzle(10)
+        for search in (BestFirst(s0), BestFirst(s0, evaluate = Evaluator(), weight = 0.5)):
+            route = search.run()
+            self.assertTrue(route[-1].s.isGoal())
+            self.assertEqual(len(route), 10)
+            self.assertEqual(Solver.replay(s0, Solver.moves(route))[-1].s, route[-1].s)
+            self.assertEqual(search.dropped, 0)
+
+    def test_cap(self):
+        s0 = State.fromFen(Bench.fen)
+        search = BestFirst(s0, weight = 0, cap = 8)
+        frontier = [(-len(s2.ps), i, 1, Node(s2)) for i, s2 in enumerate(s0.transition().values())]
+        heapq.heapify(frontier)
+
+        # the best entries are kept, still forming a heap
+        kept = search.trim(frontier)
+        self.assertEqual(len(kept), 6)
+        self.assertEqual(search.dropped, len(frontier) - 6)
+        self.assertEqual(kept, sorted(frontier)[:6])
+
+        # the frontier never grows far beyond the cap
+        search = BestFirst(Generator(rng = 6).getPuzzle(10), weight = 0, cap = 8)
+        search.run()
+        self.assertTrue(search.dropped > 0)
+
+class TestBidirectional(unittest.TestCase):
+    def test_run(self):
+        s0 = Generator(rng = 8).getPuzzle(10)
+        search = Bidirectional(s0, reverse = 5000)
+        route = search.run()
+
+        self.assertTrue(route[-1].s.isGoal())
+        self.assertEqual(len(route), 10)
+        self.assertEqual(Solver.replay(s0, Solver.moves(route))[-1].s, route[-1].s)
+        self.assertEqual(search.meetings, 1)
+        self.assertTrue(search.complete >= 2)
+
+    def test_layers(self):
+        s0 = Generator(rng = 8).getPuzzle(6)
+        search = Bidirectional(s0, reverse = 10 ** 6)
+        search.backward()
+        self.assertEqual(search.complete, 5)
+
+        # every forward state with up to 5 pieces is in the table exactly if it can still be won
+        memo = dict()
+        Generator.countSolutions(s0, memo)
+        for s, n in memo.items():
+            if len(s.ps) < 6:
+                self.assertEqual(s.toBytes() in search.reverse, n > 0)
+
+        # the stored captures lead to the goal
+        s = next(s for s, n in memo.items() if len(s.ps) == 4 and n > 0)
+        self.assertTrue(search.join(Node(s), s.toBytes()).s.isGoal())
+
+class TestScheduler(unittest.TestCase):
+    def test_step(self):
+        s0 = Generator(rng = 9).getPuzzle(10)
+        bt = Backtrack(s0, h = "R")
+        route = None
+        steps = 0
+        while not bt.done:
+            route = bt.step(3)
+            steps += 1
+        self.assertEqual(Solver.moves(route), Solver.moves(Backtrack(s0, h = "R").run()))
+        self.assertTrue(bt.visited <= 3 * steps)
+
+        mcts = MCTS(s0, h = "R", rng = 9)
+        while not mcts.done:
+            route = mcts.step(5)
+        self.assertEqual(Solver.moves(route), Solver.moves(MCTS(s0, h = "R", rng = 9).run()))
+
+    def test_run(self):
+        states = [Generator(rng = i).getPuzzle(4 + i % 5) for i in range(10)]
+        scheduler = Scheduler("mcts", {"h": "R"}, width = 4, chunk = 2)
+        results = list(scheduler.run((i, s0.toBytes(), i) for i, s0 in enumerate(states)))
+
+        self.assertEqual(sorted(r["pid"] for r in results), list(range(10)))
+        for r in results:
+            self.assertEqual(r["status"], "solved")
+            self.assertTrue(Solver.replay(states[r["pid"]], r["route"])[-1].s.isGoal())
+        self.assertTrue(scheduler.turns > scheduler.finished == 10)
+        # the rollout cache is shared by the searches
+        self.assertTrue(len(scheduler.params["memo"]) > 0)
+
+        # searches that cannot end are stopped by the time limit
+        k = Piece("K")
+        p = Piece("P")
+        square = {k: Square(0, 0), p: Square(5, 5)}
+        results = list(Scheduler("backtrack", timeout = 0).run([(0, State(square), None)]))
+        self.assertEqual(results[0]["status"], "unsolved")
+        results = list(Scheduler("mcts", timeout = 0).run([(0, State(square), None)]))
+        self.assertEqual(results[0]["status"], "timeout")
+
+    def test_cache(self):
+        states = [Generator(rng = i).getPuzzle(6) for i in range(6)]
+        with tempfile.TemporaryDirectory() as tmp:
+            with SolutionCache(os.path.join(tmp, "cache.db")) as cache:
+                scheduler = Scheduler("mcts", {"h": "R"}, width = 3, chunk = 2, cache = cache)
+                for result in scheduler.run((i, s0, 10 + i) for i, s0 in enumerate(states)):
+                    # the collector is only off during the turns
+                    self.assertTrue(gc.isenabled())
+                # every solution is stored with the seed of its puzzle
+                for i, s0 in enumerate(states):
+                    self.assertEqual(cache.get(s0)["params"], {"h": "R", "rng": 10 + i})
+
+                results = list(Scheduler.solveAll(states, "mcts", {"h": "R"}, workers = 2, cache = cache))
+                self.assertEqual([r["status"] for r in results], ["cached"] * len(states))
+
+        # the backward phase of Bidirectional would run in a single turn
+        with self.assertRaises(ValueError):
+            Scheduler("bidirectional")
+
+    def test_worker(self):
+        states = [Generator(rng = i).getPuzzle(6 + i % 3) for i in range(8)]
+        # batches are taken from the tasks as they are needed
+        tasks = ((i, states[i % 8], None) for i in itertools.count())
+        batches = Scheduler.batches(tasks, 4)
+        first, second = next(batches), next(batches)
+        self.assertEqual([task[0] for task in first + second], list(range(8)))
+        self.assertEqual(first[0][1], states[0].toBytes())
+
+        # the scheduler of a worker and its rollout cache serve all of its batches
+        Scheduler.startWorker("mcts", {"h": "R"}, 4, None)
+        try:
+            memo = Scheduler.workerScheduler.params["memo"]
+            results = Scheduler.solveBatch(first)
+            size = len(memo)
+            results += Scheduler.solveBatch(second)
+            self.assertIs(Scheduler.workerScheduler.params["memo"], memo)
+            self.assertTrue(len(memo) >= size > 0)
+            self.assertEqual(Scheduler.workerScheduler.finished, 8)
+            self.assertEqual(sorted(r["pid"] for r in results), list(range(8)))
+        finally:
+            Scheduler.workerScheduler = None
+
+class TestPortfolio(unittest.TestCase):
+    def test_run(self):
+        s0 = Generator().getPuzzle(8)
+        with tempfile.TemporaryDirectory() as tmp:
+            log = os.path.join(tmp, "portfolio.jsonl")
+            portfolio = Portfolio(s0, timeout = 30, seed = 0, log = log)
+            route = portfolio.run()
+
+            self.assertTrue(route[-1].s.isGoal())
+            self.assertIs(route[0].s, s0)
+            self.assertIn(portfolio.winner, [Portfolio.label(*config) for config in Portfolio.default])
+
+            rates = Portfolio.winRates(log)
+            self.assertEqual(len(rates), len(Portfolio.default))
+            self.assertEqual(sum(wins for wins, _ in rates.values()), 1)
+            self.assertTrue(all(races == 1 for _, races in rates.values()))
+
+    def test_unsolvable(self):
+        k = Piece("K")
+        p = Piece("P")
+        square = {k: Square(0, 0), p: Square(5, 5)}
+        portfolio = Portfolio(State(square), [("backtrack", {}), ("nmcs", {"level": 1})])
+
+        self.assertIsNone(portfolio.run())
+        self.assertIsNone(portfolio.winner)
+        self.assertEqual(len(portfolio.results), 2)
+
+class TestSolutionCache(unittest.TestCase):
+    def test_cache(self):
+        s0 = State.fromFen(Bench.fen)
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, "cache.db")
+            with SolutionCache(fn) as cache:
+                self.assertIsNone(cache.get(s0))
+                self.assertTrue(cache.put(s0, ["Qe4xe5"], "mcts", {"c": 2}, 10, 0.5))
+                self.assertFalse(cache.put(s0, ["Qe4xe3"], "backtrack"))
+
+                # equal states share the entry, the first solution is kept
+                entry = cache.get(State.fromFen(Bench.fen))
+                self.assertEqual(entry["moves"], ["Qe4xe5"])
+                self.assertEqual(entry["params"], {"c": 2})
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+                # a copy in another process reads the same file
+                copy = pickle.loads(pickle.dumps(cache))
+                self.assertIn(s0, copy)
+                self.assertEqual(len(copy), 1)
+                copy.close()
+
+    def test_solve(self):
+        s0 = Generator().getPuzzle(8)
+        with tempfile.TemporaryDirectory() as tmp:
+            with SolutionCache(os.path.join(tmp, "cache.db")) as cache:
+                first = Solver.solve((0, s0, "backtrack", {"h": "R"}, None, None), cache)
+                second = Solver.solve((1, s0, "mcts", {}, None, None), cache)
+
+                self.assertEqual(first["status"], "solved")
+                self.assertEqual(second["status"], "cached")
+                self.assertEqual(second["solver"], "backtrack")
+                self.assertEqual(second["route"], first["route"])
+                self.assertTrue(Solver.replay(s0, second["route"])[-1].s.isGoal())
+
+                # pool workers open the cache once and are served from it
+                results = list(Solver.solveAll([s0] * 4, "mcts", {}, workers = 2, cache = cache))
+                self.assertEqual([r["status"] for r in results], ["cached"] * 4)
+
+class TestService(unittest.TestCase):
+    def test_solve(self):
+        s0 = Generator().getPuzzle(8)
+        other = Generator().getPuzzle(9)
+        service = Service(workers = 1, queue = 1, solver = "backtrack", params = {"h": "R"})
+
+        async def requests():
+            # the second request for the same puzzle joins the first solve
+            results = await asyncio.gather(service.solve(s0), service.solve(State.fromFen(s0.toFen())))
+            # a single puzzle fits in the queue
+            task = asyncio.ensure_future(service.solve(s0))
+            await asyncio.sleep(0)
+            with self.assertRaises(Busy):
+                await service.solve(other)
+            await task
+            return results
+
+        try:
+            first, second = asyncio.run(requests())
+        finally:
+            service.close()
+
+        self.assertEqual(first["status"], "solved")
+        self.assertEqual(second["route"], first["route"])
+        self.assertEqual([first["coalesced"], second["coalesced"]], [False, True])
+        self.assertEqual(service.solves, 2)
+        self.assertEqual(len(service.inflight), 0)
+
+    def test_handle(self):
+        s0 = Generator().getPuzzle(8)
+        service = Service(workers = 1, solver = "backtrack")
+
+        async def session(path):
+            server = await asyncio.start_unix_server(service.handle, path)
+            async with server:
+                reader, writer = await asyncio.open_unix_connection(path)
+                lines = [{"id": 1, "fen": s0.toFen(), "deadline": 30}, {"id": 2, "fen": "not a puzzle"}, {"fen": s0.toFen()}]
+                writer.write("".join(json.dumps(line) + "\n" for line in lines).encode())
+                writer.write_eof()
+                answers = [json.loads(line) async for line in reader]
+                writer.close()
+                return {a["id"]: a for a in answers}
+
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                answers = asyncio.run(session(os.path.join(tmp, "service.sock")))
+        finally:
+            service.close()
+
+        self.assertEqual(answers[1]["status"], "solved")
+        self.assertTrue(Solver.replay(s0, answers[1]["route"])[-1].s.isGoal())
+        self.assertEqual(answers[2]["status"], "error")
+        # a request without an id could not be told apart from other ones
+        self.assertEqual(answers[None]["status"], "error")
+
+    def test_load(self):
+        s0 = Generator().getPuzzle(8)
+        hard = Generator(rng = 1).getPuzzle(16)
+        service = Service(workers = 1, queue = 1, solver = "mcts", timeout = 2)
+
+        async def requests():
+            # starts the worker, so the next job runs right away
+            await service.solve(s0)
+            task = asyncio.ensure_future(service.solve(hard))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await asyncio.sleep(0.1)
+            # the abandoned job still runs and holds the only place in the queue
+            self.assertEqual(len(service.inflight), 0)
+            with self.assertRaises(Busy):
+                await service.solve(s0)
+            while service.load() > 0:
+                await asyncio.sleep(0.1)
+            return await service.solve(s0)
+
+        try:
+            result = asyncio.run(requests())
+        finally:
+            service.close()
+
+        self.assertEqual(result["status"], "solved")
+
 class TestGenerator(unittest.TestCase):
     def test_expand(self):
         g = Generator()
@@ -521,12 +1238,215 @@ class TestGenerator(unittest.TestCase):
 
         self.assertTrue(len(sqrs) == 8)
     
+    def test_getExpansionMask(self):
+        g = Generator()
+
+        # the tables agree with Utils.possMovements for every piece type
+        qs = {Square(1, 1), Square(2, 2), Square(4, 1), Square(4, 6), Square(6, 3)}
+        for t in ["Q", "R", "B", "N", "P", "K"]:
+            p = Piece(t)
+            for q in qs:
+                m = g.getExpansionMask(p, q, Utils.toMask(qs))
+                sqrs = [Utils.fromIndex(i) for i in Utils.bits(m)]
+                self.assertEqual(sorted(sqrs), sorted(Utils.possMovements(p, q, qs)))
+
+        # and the forward tables with Utils.canReach
+        q = Piece("Q")
+        for q1 in qs:
+            m = Utils.attacks(q.type, Utils.toIndex(q1), Utils.toMask(qs))
+            for q2 in qs - {q1}:
+                self.assertEqual(bool(m >> Utils.toIndex(q2) & 1), Utils.canReach(q, q1, q2, qs))
+
     def test_fullGeneration(self):
         g = Generator()
         s0 = g.getPuzzle(4)
         
         self.assertTrue(len(s0.ps) == 4)
 
+    def test_difficulty(self):
+        k = Piece("K")
+        p1 = Piece("P")
+        p2 = Piece("P")
+
+        # only k takes p1 followed by k takes p2 wins
+        square = {
+            k: Square(4, 4),
+            p1: Square(3, 3),
+            p2: Square(2, 4)
+        }
+        s0 = State(square)
+
+        self.assertEqual(Generator.difficulty(s0, "solutions"), 1)
+        self.assertTrue(Generator.difficulty(s0, "visited") >= 2)
+
+        # the node limit makes the measure unknown
+        self.assertIsNone(Generator.difficulty(s0, "visited", limit = 1))
+
+    def test_getPuzzles(self):
+        g = Generator()
+        puzzles = g.getPuzzles(6, 3, (1, 50))
+
+        self.assertEqual(len(puzzles), 3)
+        for s0, d in puzzles:
+            self.assertEqual(len(s0.ps), 6)
+            self.assertTrue(1 <= d <= 50)
+
+        puzzles = g.getPuzzles(5, 2, (1, 50), measure = "solutions", workers = 2)
+        self.assertEqual(len(puzzles), 2)
+
+        # a narrow band of solution counts does not bound the states expanded to count them
+        puzzles = Generator(rng = 2).getPuzzles(6, 2, (5, 15), measure = "solutions")
+        self.assertEqual(len(puzzles), 2)
+        for s0, d in puzzles:
+            self.assertTrue(5 <= d <= 15)
+            self.assertEqual(Generator.countSolutions(s0, dict()), d)
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.fn = os.path.join(self.dir.name, "puzzles.bin")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_pack(self):
+        k = Piece("K")
+        q = Piece("Q")
+        p = Piece("P")
+        square = {k: Square(0, 0), q: Square(7, 7), p: Square(3, 4)}
+        caps = {k: 2, q: 0, p: 1}
+        s = State(square, caps)
+
+        rec = Corpus.pack(s)
+        self.assertEqual(len(rec), Corpus.recordSize)
+        self.assertEqual(Corpus.unpack(rec), s)
+
+        # pieces off the board cannot be stored
+        s = State({k: Square(8, 0)})
+        self.assertRaises(ValueError, Corpus.pack, s)
+
+    def test_readWrite(self):
+        g = Generator()
+        states = [g.getPuzzle(n) for n in [5, 6, 5, 7]]
+        self.assertEqual(Corpus.write(self.fn, iter(states)), 4)
+
+        with Corpus(self.fn) as c:
+            self.assertEqual(len(c), 4)
+            self.assertEqual(c[2], states[2])
+            self.assertEqual(c[-1], states[3])
+            self.assertEqual(list(c), states)
+            self.assertEqual(c.select(5), [0, 2])
+            self.assertEqual(c.select(8), [])
+            selected = c.select(7)
+
+            # workers reopen the file instead of copying it
+            c2 = pickle.loads(pickle.dumps(c))
+            self.assertEqual(c2[1], states[1])
+            c2.close()
+
+        # the selection outlives the map
+        self.assertEqual(selected, [3])
+
+    def test_fen(self):
+        k = Piece("K")
+        q = Piece("Q")
+        p = Piece("P")
+        square = {k: Square(0, 0), q: Square(7, 7), p: Square(3, 4)}
+        caps = {k: 2, q: 0, p: 1}
+        s = State(square, caps)
+
+        self.assertEqual(s.toFen(), "7Q/8/8/3P4/8/8/8/K7 012")
+        self.assertEqual(State.fromFen("7Q/8/8/3P4/8/8/8/K7 012"), s)
+
+        # captures default to 2
+        s = State.fromFen("8/8/8/8/8/8/8/K6P")
+        self.assertEqual(sorted(s.caps.values()), [2, 2])
+
+        # lowercase and other letters are no pieces
+        with self.assertRaisesRegex(ValueError, "unknown piece 'x'"):
+            State.fromFen("8/8/8/8/8/8/8/K6x")
+        # every rank has 8 files and there are 8 ranks, otherwise pieces would end up off the board
+        for fen in ["8/8/8/8/8/8/8/K8", "8/8/8/8/8/8/8/K6", "8/8/8/8/8/8/8/8/K7", "8/8/8/8/8/8/K7", ""]:
+            with self.assertRaises(ValueError):
+                State.fromFen(fen)
+
+        fn = os.path.join(self.dir.name, "puzzles.fen")
+        g = Generator()
+        states = [g.getPuzzle(n) for n in [4, 8, 12]]
+        self.assertEqual(Corpus.writeFen(fn, iter(states)), 3)
+        self.assertEqual(list(Corpus.read(fn)), states)
+
+        # binary files are detected by Corpus.read as well
+        Corpus.write(self.fn, states)
+        self.assertEqual(list(Corpus.read(self.fn)), states)
+
+    def test_bytes(self):
+        k = Piece("K")
+        q = Piece("Q")
+        p = Piece("P")
+        s = State({k: Square(0, 0), q: Square(7, 7), p: Square(3, 4)}, {k: 2, q: 0, p: 1})
+
+        b = s.toBytes()
+        self.assertEqual(b, (1 | 1 << 35 | 1 << 63).to_bytes(8, "little") + bytes([0x62, 0x51, 0x10]))
+        self.assertEqual(State.fromBytes(b), s)
+        self.assertEqual(State.fromFen(s.toFen()).toBytes(), b)
+
+        g = Generator()
+        states = [g.getPuzzle(n) for n in range(1, 17)]
+        buf = State.packMany(states)
+        self.assertEqual(len(buf), sum(8 + len(s.ps) for s in states))
+        self.assertEqual(State.unpackMany(buf), states)
+
+        with self.assertRaises(ValueError):
+            State({k: Square(8, 0)}).toBytes()
+
+class TestSolver(unittest.TestCase):
+    def test_route(self):
+        s0 = Generator().getPuzzle(7)
+
+        for solver in [MCTS(s0, h = "R"), Backtrack(s0, h = "R")]:
+            route = solver.run()
+            self.assertTrue(route[-1].s.isGoal())
+            self.assertEqual(len(route), 7)
+
+            # moves can be replayed on a copy of the puzzle
+            moves = Solver.moves(route)
+            s1 = State.fromFen(s0.toFen())
+            self.assertTrue(Solver.replay(s1, moves)[-1].s.isGoal())
+
+    def test_solve(self):
+        s0 = Generator().getPuzzle(6)
+
+        result = Solver.solve((3, s0, "backtrack", {"h": "R", "c": 2}, None, None))
+        self.assertEqual(result["pid"], 3)
+        self.assertEqual(result["status"], "solved")
+        self.assertEqual(len(result["route"]), 5)
+
+        results = list(Solver.solveAll([s0, s0], "mcts", {"h": "R"}, workers = 2, timeout = 10))
+        self.assertEqual(sorted(r["pid"] for r in results), [0, 1])
+
+class TestBench(unittest.TestCase):
+    def test_compare(self):
+        baseline = {
+            "micro": {"State.getActions": 100.0, "MCTS.uct": 1.0},
+            "macro": {"mcts": {"10": {"wall": 2.0, "cpu": 2.0, "visited": 500, "solved": 5, "count": 5}}}
+        }
+        results = {
+            "micro": {"State.getActions": 105.0, "MCTS.uct": 1.5},
+            "macro": {"mcts": {"10": {"wall": 1.0, "cpu": 1.0, "visited": 500, "solved": 4, "count": 5}}}
+        }
+
+        rows = Bench.compare(results, baseline, 0.1)
+        regressed = {name for (name, _, _, _, r) in rows if r}
+        self.assertEqual(regressed, {"MCTS.uct", "mcts/10/solved"})
+
+    def test_corpus(self):
+        # the pinned corpus has five puzzles for every piece count
+        counts = dict()
+        for s in Corpus.read(Bench.corpus):
+            counts[len(s.ps)] = counts.get(len(s.ps), 0) + 1
+        self.assertEqual(counts, {n: 5 for n in range(5, 15)})
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 from math import sqrt
+import random as rd
 
 class Square():
     def __init__(self, x, y):
@@ -25,7 +26,27 @@ class Utils():
 
     These methods are mostly about implementing rules of chess and movement patterns for pieces.
     That requires long and boring code, which is why it's hidden away in this class.
+
+    Besides the methods working on Square objects, this class holds per-square tables on the 8x8 board.
+    Squares are indexed as 8*y + x and sets of squares are bitmasks with bit i set for square i.
+    The tables are filled by buildTables() when this module is imported.
     """
+    # directions (dx, dy) of sliding pieces. The first four increase the square index, the last four decrease it
+    dirs = [(0, 1), (1, 0), (1, 1), (-1, 1), (0, -1), (-1, 0), (-1, -1), (1, -1)]
+
+    # the directions each sliding piece type can move in
+    slides = {
+        1: [0, 1, 2, 3, 4, 5, 6, 7],
+        2: [0, 1, 4, 5],
+        3: [2, 3, 6, 7]
+    }
+
+    # rays[d][i]: the squares in direction d from square i, excluding i
+    rays = []
+    # steps[t][i]: the squares a non-sliding piece of type t on square i can capture on
+    steps = dict()
+    # unsteps[t][i]: the squares a non-sliding piece of type t can capture on square i from
+    unsteps = dict()
     @classmethod
     def visualizeState(cls, s):
         """Visualizes the game board in a simple grid on the terminal
@@ -46,6 +67,212 @@ class Utils():
             print()
         
     
+    @classmethod
+    def buildTables(cls):
+        """Fills the per-square ray and step tables
+        """
+        def onBoard(x, y):
+            return 0 <= x <= 7 and 0 <= y <= 7
+
+        def mask(offsets, i):
+            x, y = i & 7, i >> 3
+            return sum(1 << (8*(y + dy) + x + dx) for (dx, dy) in offsets if onBoard(x + dx, y + dy))
+
+        cls.rays = []
+        for (dx, dy) in cls.dirs:
+            ray = []
+            for i in range(64):
+                m = 0
+                x, y = (i & 7) + dx, (i >> 3) + dy
+                while onBoard(x, y):
+                    m |= 1 << (8*y + x)
+                    x, y = x + dx, y + dy
+                ray.append(m)
+            cls.rays.append(ray)
+
+        knight = [(i, j) for i in [-2, -1, 1, 2] for j in [-2, -1, 1, 2] if abs(i) != abs(j)]
+        king = [(i, j) for i in [-1, 0, 1] for j in [-1, 0, 1] if not i == 0 == j]
+
+        cls.steps = {
+            4: [mask(knight, i) for i in range(64)],
+            5: [mask([(-1, 1), (1, 1)], i) for i in range(64)],
+            6: [mask(king, i) for i in range(64)]
+        }
+        cls.unsteps = {
+            4: cls.steps[4],
+            5: [mask([(-1, -1), (1, -1)], i) for i in range(64)],
+            6: cls.steps[6]
+        }
+
+    @classmethod
+    def toIndex(cls, q):
+        """Returns the table index of square q
+        """
+        return 8*q.y + q.x
+
+    @classmethod
+    def fromIndex(cls, i):
+        """Returns the square with table index i
+        """
+        return Square(i & 7, i >> 3)
+
+    @classmethod
+    def toMask(cls, qs):
+        """Returns the bitmask of a collection of squares
+        """
+        m = 0
+        for q in qs:
+            m |= 1 << (8*q.y + q.x)
+        return m
+
+    @classmethod
+    def squareName(cls, q):
+        """Returns the algebraic name of a square, e.g. d4 for Square(3, 3)
+        """
+        return "abcdefgh"[q.x] + str(q.y + 1)
+
+    @classmethod
+    def parseSquare(cls, name):
+        """Returns the square with algebraic name name, the inverse of cls.squareName
+        """
+        return Square("abcdefgh".index(name[0]), int(name[1:]) - 1)
+
+    @classmethod
+    def actionKey(cls, s, p1, p2):
+        """Identifies a capture independently of the state it is made in
+
+        Args:
+            s: the state in which p1 captures p2
+
+        Returns:
+            A (from-square, to-square, type) tuple, where type is the type of the capturing piece
+        """
+        return (s.square[p1], s.square[p2], p1.type)
+
+    @classmethod
+    def makeRng(cls, rng = None):
+        """Turns the rng argument of the solvers and the generator into a random number generator
+
+        Args:
+            rng = None: None for the global random module, an int seed, a random.Random or a NumPy Generator
+
+        Returns:
+            An object with the randint, choice, choices, random, getstate and setstate methods of random.Random
+        """
+        if rng is None:
+            return rd
+        if isinstance(rng, (rd.Random, NumpyRng)):
+            return rng
+        if isinstance(rng, int):
+            return rd.Random(rng)
+        if hasattr(rng, "bit_generator"):
+            return NumpyRng(rng)
+        raise TypeError(f"cannot make a random number generator from {rng!r}")
+
+    @classmethod
+    def streamSeed(cls, seed, i):
+        """Derives the seed of stream i from a base seed
+
+        Seeds are hashed rather than offset, so nearby streams share no structure.
+
+        Returns:
+            An int seed
+        """
+        return rd.Random(f"{seed}/{i}").getrandbits(64)
+
+    @classmethod
+    def spawnRngs(cls, seed, n):
+        """Creates independent random number generators, e.g. one per worker process
+
+        Args:
+            seed: an int seed, None for fresh entropy, or a NumPy Generator to spawn NumPy streams from
+            n: the number of generators
+
+        Returns:
+            A list of n generators, random.Random objects or NumpyRng objects for a NumPy Generator
+        """
+        if hasattr(seed, "bit_generator"):
+            return [NumpyRng(g) for g in seed.spawn(n)]
+        if seed is None:
+            return [rd.Random() for _ in range(n)]
+        return [rd.Random(cls.streamSeed(seed, i)) for i in range(n)]
+
+    @classmethod
+    def bits(cls, m):
+        """Yields the indices of the set bits of bitmask m in increasing order
+        """
+        while m:
+            low = m & -m
+            yield low.bit_length() - 1
+            m ^= low
+
+    @classmethod
+    def slide(cls, d, i, occ):
+        """Returns the squares a sliding piece on square i sees in direction d
+
+        The ray stops at the first occupied square, which is included.
+
+        Args:
+            d: index into cls.dirs
+            i: index of the square the piece is on
+            occ: bitmask of occupied squares
+
+        Returns:
+            A bitmask
+        """
+        ray = cls.rays[d][i]
+        blockers = ray & occ
+        if blockers == 0:
+            return ray
+
+        # the nearest blocker is the lowest set bit for increasing directions and the highest for decreasing ones
+        if d < 4:
+            j = (blockers & -blockers).bit_length() - 1
+        else:
+            j = blockers.bit_length() - 1
+        return ray ^ cls.rays[d][j]
+
+    @classmethod
+    def attacks(cls, t, i, occ):
+        """Returns the squares a piece of type t on square i can capture on
+
+        Args:
+            t: the type of the piece
+            i: index of the square the piece is on
+            occ: bitmask of occupied squares
+
+        Returns:
+            A bitmask, which still has to be intersected with occ to give actual captures
+        """
+        if t in cls.slides:
+            m = 0
+            for d in cls.slides[t]:
+                m |= cls.slide(d, i, occ)
+            return m
+        return cls.steps[t][i]
+
+    @classmethod
+    def expansions(cls, t, i, occ):
+        """Returns the empty squares a piece of type t could have captured on square i from
+
+        This is the reverse of cls.attacks and is used for generating puzzles backwards.
+        Sliding moves are symmetric, pawns capture upwards so they expand downwards.
+
+        Args:
+            t: the type of the piece
+            i: index of the square the piece is on
+            occ: bitmask of occupied squares
+
+        Returns:
+            A bitmask of unoccupied squares
+        """
+        if t in cls.slides:
+            m = 0
+            for d in cls.slides[t]:
+                m |= cls.slide(d, i, occ)
+            return m & ~occ
+        return cls.unsteps[t][i] & ~occ
+
     @classmethod
     def distance(cls, q1, q2):
         """Returns euclidiean distance between two squares
@@ -252,4 +479,41 @@ class Utils():
             case other:
                 sqrs = sqrs
 
-        return sqrs
\ No newline at end of file
+        return sqrs
+
+
+class NumpyRng():
+    """Adapts a NumPy Generator to the methods of random.Random used by the solvers and the generator
+
+    Attributes:
+        gen: the numpy.random.Generator drawn from
+    """
+    def __init__(self, gen):
+        self.gen = gen
+
+    def random(self):
+        return float(self.gen.random())
+
+    def randint(self, a, b):
+        """Returns an int in the inclusive range [a, b]
+        """
+        return int(self.gen.integers(a, b + 1))
+
+    def choice(self, seq):
+        return seq[int(self.gen.integers(len(seq)))]
+
+    def choices(self, population, weights = None, k = 1):
+        if weights is None:
+            return [self.choice(population) for _ in range(k)]
+        total = sum(weights)
+        idx = self.gen.choice(len(population), size=k, p=[w / total for w in weights])
+        return [population[int(i)] for i in idx]
+
+    def getstate(self):
+        return self.gen.bit_generator.state
+
+    def setstate(self, state):
+        self.gen.bit_generator.state = state
+
+
+Utils.buildTables()